@@ -7,28 +7,95 @@ This project implements a simple web server that provides a REST API to
 peripheral devices like the Adafruit MagTag, PyPortal, or Matrix Portal.
 The REST API provides information about the latest Instructables contests.
 
-Basically there are three links served up by this web server:
+Basically there are ten links served up by this web server:
 - http://127.0.0.1:5000/ - This page just shows the information collected.
 - http://127.0.0.1:5000/api/v1/contests - JSON data about the contests
+- http://127.0.0.1:5000/api/v1/contests/<contest_id>/history - Entry counts of a contest over time
 - http://127.0.0.1:5000/api/v1/meta - JSON data about the server itself
+- http://127.0.0.1:5000/api/v1/fleet - Devices checking in with ?device= and when they'll refresh
+- http://127.0.0.1:5000/api/v1/snapshot - Contests and meta in a single response
+- http://127.0.0.1:5000/api/v1/wait?version=N - Waits for a newer snapshot than version N
+- http://127.0.0.1:5000/api/v1/refresh - POST with the REFRESH_TOKEN to update right away
+- http://127.0.0.1:5000/api/v1/image/<contest>/<variant> - Contest graphic rendered for a device
+- http://127.0.0.1:5000/metrics - Scrape and request timings in Prometheus text format
+
+When several worker processes serve the app (gunicorn, uWSGI) only the one
+holding LEADER_LOCK_FILE scrapes Instructables. The others serve the snapshot
+it saves to SNAPSHOT_FILE and take over if it goes away. With gunicorn --preload
+the master process, which imported the app, scrapes and the workers follow it.
+
+A request to /api/v1/wait holds a thread for up to LONG_POLL_TIMEOUT seconds. Run
+gunicorn with threaded or async workers (--worker-class gthread --threads 32, or
+gevent) and a --timeout above LONG_POLL_TIMEOUT: a default sync worker answers one
+request at a time and is killed when one takes longer than 30 seconds.
 
 By default, the server responds on all IP addresses at port 5000 on the
 host computer.
 """
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, Response, abort, g
+from flask import json as flask_json
 import requests
 import threading
 import time
-from bs4 import BeautifulSoup
-from datetime import datetime
+from bs4 import BeautifulSoup, SoupStrainer
+from datetime import datetime, timedelta, timezone
 from PIL import Image, ImageDraw
 import io
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields, replace, astuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import gzip
+import pickle
+import bisect
+import random
+import hmac
+import math
+import sqlite3
+
+try:
+    import fcntl  # Not available on Windows, where every process scrapes for itself
+except ImportError:
+    fcntl = None
+try:
+    import brotli  # Optional, brotli variants of the API responses are only served when installed
+except ImportError:
+    brotli = None
 
-URL = "https://www.instructables.com/contest/"
+URL = os.environ.get('CONTEST_URL', "https://www.instructables.com/contest/")  # Override to scrape a local copy
 UPDATE_EVERY = 120  # Number of minutes between updates from Instructables
 # UPDATE_EVERY = 15  # TEST VALUE REMOVE
+MIN_UPDATE_EVERY = 10  # Fewest minutes between updates, reached as a contest deadline gets close
+MAX_UPDATE_EVERY = 24 * 60  # Most minutes between updates, reached by backing off while nothing changes
+UPDATE_JITTER = 0.1  # Fraction of the interval randomly added or taken away so updates don't line up
+REFRESH_WINDOW = 10 * 60  # Seconds over which devices' refreshes are spread after each update
+DEVICE_FORGET = 24 * 60 * 60  # Seconds after its last check-in a device stops counting towards the fleet
+DEVICE_LIMIT = 10000  # Devices remembered at most, the longest silent are forgotten first
+REFRESH_TOKEN = os.environ.get('REFRESH_TOKEN')  # Bearer token for POST /api/v1/refresh, disabled when unset
+IMAGE_WORKERS = 4  # Number of contest graphics downloaded and converted at the same time
+IMAGE_DIR = 'static/contestImg/'
+IMAGE_CACHE_FILE = IMAGE_DIR + 'cache.json'  # Maps the banner URI of a contest to the hash of its source
+IMAGE_LRU_BYTES = 16 * 1024 * 1024  # Memory used to keep rendered graphics
+IMAGE_MAX_AGE = 7 * 24 * 60 * 60  # Seconds devices and browsers may cache a rendered graphic
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # Seconds a graphic fetched by its content-hashed URI may be cached
+GRAPHIC_VERSION_LENGTH = 16  # Characters of the banner source hash put in contest_graphic_uri
+FETCH_TIMEOUT = (5, 30)  # Seconds to wait for a connection and between bytes of a response
+CONVERT_MODE = 'exact'  # 'exact' decodes fully and fits a palette, 'fast' decodes at reduced scale and uses fixed ones
+CONVERT_MODES = ('exact', 'fast')  # Modes a graphic URI can name, so URIs handed out earlier keep working
+PARSE_MODE = 'strained'  # 'strained' only builds the tree under #cur-contests, 'full' parses the whole page
+DELTA_HISTORY = 32  # Versions ?since= can be answered with a delta for, a scrape may publish one per banner
+LONG_POLL_TIMEOUT = 300  # Longest number of seconds /api/v1/wait holds a request open, keep below worker timeouts
+SNAPSHOT_FILE = 'snapshot.pickle'  # Last published snapshot, served right away when the server restarts
+LEADER_LOCK_FILE = 'scraper.lock'  # Held by the one worker process that scrapes Instructables
+REFRESH_FILE = SNAPSHOT_FILE + '.refresh'  # Created by other workers to ask the scraping one for an update
+HISTORY_FILE = 'history.sqlite3'  # Entry count of every contest at every update, and the devices' check-ins
+HISTORY_POINTS = 100  # Points /history returns unless asked for another number, at most HISTORY_MAX_POINTS
+HISTORY_MAX_POINTS = 1000
+SHARED_POLL_SECONDS = 5  # How often workers check SNAPSHOT_FILE, LEADER_LOCK_FILE and REFRESH_FILE
 
 app = Flask(__name__)
 pyportal_clip_upper_left = (260, 7)
@@ -36,7 +103,100 @@ pyportal_clip_lower_right = (740, 367)
 pyportal_size = (320, 240)
 
 
-@dataclass
+@dataclass(frozen=True)
+class Rendition:
+    size: tuple
+    clip: tuple  # Box of the banner to use, None for the largest centered box with the aspect ratio of size
+    colors: int
+    grayscale: bool
+    text_box: list  # Black box drawn where the device puts its text, None for no box
+
+
+RENDITIONS = {  # Graphic variant made for each device, selected with ?variant= or a profile of the same name
+    'pyportal': Rendition(pyportal_size, (*pyportal_clip_upper_left, *pyportal_clip_lower_right), 256, False,
+                          [(20, 195), (300, 235)]),
+    'matrix': Rendition((64, 32), None, 16, False, None),  # 64x32 RGB LED matrix
+    'magtag': Rendition((296, 128), None, 4, True, None),  # 4 level grayscale e-ink
+}
+DEFAULT_VARIANT = 'pyportal'  # The variant contest_graphic_uri points at
+GRAY_PALETTE = Image.new('P', (1, 1))
+GRAY_PALETTE.putpalette([level for gray in (0, 85, 170, 255) for level in (gray, gray, gray)] * 64)
+
+METRIC_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+
+
+def metric_labels(names, values, extra=''):
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{metric_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.series = {}  # Label values -> per bucket counts (including +Inf), followed by the sum and the count
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        bucket = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        with self.lock:
+            series = self.series.setdefault(label_values, [0] * (len(METRIC_BUCKETS) + 3))
+            series[bucket] += 1  # The bucket past the last bound counts the +Inf overflow
+            series[-2] += seconds
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                cumulative = 0
+                for le, count in zip(METRIC_BUCKETS + ('+Inf',), series):
+                    cumulative += count
+                    bucket_labels = metric_labels(self.labels, label_values, 'le="' + str(le) + '"')
+                    lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{self.name}_sum{metric_labels(self.labels, label_values)} {series[-2]}')
+                lines.append(f'{self.name}_count{metric_labels(self.labels, label_values)} {series[-1]}')
+        return lines
+
+
+scrape_seconds = Histogram('contest_scrape_stage_seconds',
+                           'Time spent in each stage of a contest update', ('stage',))
+request_seconds = Histogram('contest_http_request_duration_seconds',
+                            'Time taken to answer requests', ('route',))
+requests_total = Counter('contest_http_requests_total', 'Requests answered', ('route', 'status'))
+check_ins_total = Counter('contest_device_check_ins_total', 'Requests made by devices naming themselves', ('route',))
+cache_total = Counter('contest_cache_lookups_total', 'Cache lookups by outcome', ('cache', 'result'))
+metrics = (scrape_seconds, request_seconds, requests_total, check_ins_total, cache_total)
+
+
+@dataclass(frozen=True)
 class Contest:
     name: str
     date: str
@@ -44,114 +204,1261 @@ class Contest:
     contest_uri: str
     contest_graphic_uri: str
     entry_count: str
+    contest_id: str  # contest_slug() of the name, as used by /api/v1/contests/<contest_id>/history
 
 
 @dataclass
-class Contests:
-    contests: list
+class Payload:
+    body: bytes
+    gzip: bytes
+    brotli: bytes
+    etag: str
+    mimetype: str = 'application/json'
 
 
-contests = Contests([])
+WIRE_FORMATS = {  # Encodings of the contests, selected with ?format= or the Accept header
+    'json': 'application/json',
+    'tsv': 'text/tab-separated-values',  # A header row of field names, then a row per contest
+}
 
 
-@dataclass
+def make_payload(data):
+    """
+    Serializes data to JSON once, along with its compressed variants and a strong
+    ETag, so requests can be answered straight from memory.
+    """
+    with app.app_context():
+        body = flask_json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return encoded_payload(body, WIRE_FORMATS['json'])
+
+
+def encoded_payload(body, mimetype):
+    return Payload(body,
+                   gzip.compress(body, compresslevel=9),
+                   brotli.compress(body) if brotli else None,
+                   hashlib.sha256(body).hexdigest()[:32],
+                   mimetype)
+
+
+def tsv_table(columns, rows):
+    """
+    Tab separated values with a header row. Each row is one line that a device can
+    split on tabs as it reads it, tabs and line breaks in values become spaces.
+    """
+    return ''.join('\t'.join(str(value).replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+                             for value in row) + '\n'
+                   for row in [columns] + rows).encode('utf-8')
+
+
+def payload_response(payload, last_modified=None):
+    """
+    Answers the current request with payload, honoring If-None-Match (or, without
+    one, If-Modified-Since against last_modified when given) and choosing the best
+    encoding the client accepts. Each encoding carries its own strong ETag.
+    """
+    encoding, body = None, payload.body
+    if payload.brotli and request.accept_encodings['br']:
+        encoding, body = 'br', payload.brotli
+    elif request.accept_encodings['gzip']:
+        encoding, body = 'gzip', payload.gzip
+
+    if last_modified:
+        last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+    if request.if_none_match:
+        not_modified = any(request.if_none_match.contains(etag)
+                           for etag in (payload.etag, f'{payload.etag}-br', f'{payload.etag}-gzip'))
+    else:  # HTTP dates are whole seconds, and older Werkzeug parses them without a time zone
+        if_modified_since = request.if_modified_since
+        not_modified = bool(last_modified and if_modified_since and
+                            if_modified_since.replace(tzinfo=timezone.utc) >= last_modified)
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=payload.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(f'{payload.etag}-{encoding}' if encoding else payload.etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.vary.add('Accept-Encoding')
+    response.vary.add('Accept')
+    return response
+
+
+CONTEST_FIELDS = tuple(contest_field.name for contest_field in fields(Contest))
+PROFILES = {  # Contest fields each device actually uses, selected with ?profile=
+    'magtag': ('name', 'date', 'days_until'),
+    'matrix': ('name', 'date', 'days_until'),
+    'pyportal': ('name', 'date', 'days_until', 'contest_graphic_uri'),
+}
+
+
+def contest_slug(contest_name):
+    """
+    The id of a contest in graphic URIs and the history. Only ASCII letters, digits, - and _
+    are kept, so it's a single path segment that needs no escaping, and a device can name a
+    file after it.
+    """
+    return ''.join(character for character in contest_name
+                   if character.isascii() and (character.isalnum() or character in '-_'))
+
+
+def contest_graphic_path(contest_name, source_hash):
+    """
+    The graphic URI of a contest. It names the banner source it's rendered from, so a
+    new banner gets a new URI and what was fetched from the old one never goes stale.
+    """
+    name = contest_slug(contest_name)
+    if source_hash:
+        name += '.' + source_hash[:GRAPHIC_VERSION_LENGTH]
+    return 'api/v1/image/' + name + '/' + DEFAULT_VARIANT + '-' + CONVERT_MODE
+
+
+def graphic_uri(contest_graphic_uri, variant):
+    """Points a contest_graphic_uri at another variant of the same graphic, converted the same way."""
+    path, _, name = contest_graphic_uri.rpartition('/')
+    mode = name.partition('-')[2]
+    return path + '/' + variant + ('-' + mode if mode else '')
+
+
+@dataclass(frozen=True)
 class Meta:
     current_time: str
     last_update: str
     last_update_dt: datetime
     next_update_minutes: int
     contest_count: int
+    version: int = 0  # Incremented with every contest update
+    next_update: str = ''
+    refresh_seconds: int = 0  # When the asking device should refresh, after next_update and spread by its ?device=
+
+
+@dataclass(frozen=True)
+class ContestsView:
+    """The contests of a snapshot as they stand on a given day, with their payloads."""
+    contests: tuple
+    payload: Payload
+    projections: dict  # Payloads keyed by (fields, graphic variant, wire format), beyond profiles memoized on use
+    made: datetime = field(default_factory=datetime.now)
+    pages: dict = field(default_factory=dict)  # Rendered templates by name, made on first request
+    deltas: dict = field(default_factory=dict)  # JSON of ?since= deltas by (version, fields, variant), made on use
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Everything served about one contest update. Snapshots are never changed once
+    published, a new one replaces the module level snapshot instead, so request
+    handlers read a consistent set of contests, meta and payloads without locking.
+    """
+    version: int
+    contests: tuple  # In page order
+    deadlines: tuple  # (deadline, index into contests) sorted by deadline
+    meta: Meta  # current_time, next_update_minutes and contest_count are filled in per request
+    graphics: dict  # Contest slug -> hash of its banner source, None when it couldn't be downloaded
+    views: dict  # The ContestsView last rendered, keyed by the (index, days_until) of each live contest
+    history: tuple = ()  # (version, contests) of this and up to DELTA_HISTORY - 1 earlier snapshots
+    deltas: dict = field(default_factory=dict)  # Earlier version -> (added, (old, new) changed, removed names)
+
+
+def project_contest(contest, projected_fields, variant=DEFAULT_VARIANT):
+    return [getattr(contest, name) if name != 'contest_graphic_uri'
+            else graphic_uri(contest.contest_graphic_uri, variant)
+            for name in projected_fields]
+
+
+def make_projection(contest_list, projected_fields, variant=DEFAULT_VARIANT, wire_format='json'):
+    rows = [project_contest(contest, projected_fields, variant) for contest in contest_list]
+    if wire_format == 'tsv':
+        return encoded_payload(tsv_table(projected_fields, rows), WIRE_FORMATS['tsv'])
+    return make_payload([dict(zip(projected_fields, row)) for row in rows])
+
+
+def make_view(contest_list):
+    return ContestsView(tuple(contest_list),
+                        make_payload(contest_list),
+                        {(profile_fields, profile, wire_format):
+                         make_projection(contest_list, profile_fields, profile, wire_format)
+                         for profile, profile_fields in PROFILES.items() for wire_format in WIRE_FORMATS})
+
+
+def contests_view(current):
+    """
+    Returns the contests of snapshot current that haven't ended yet, with days_until
+    counted from now. The deadline index makes this a bisect and a subtraction per
+    contest, and the rendered view is only rebuilt when a contest ends or one of the
+    countdowns ticks over to another day.
+    """
+    now = datetime.now()
+    ending = current.deadlines[bisect.bisect_left(current.deadlines, (now,)):]
+    live = sorted((index, deadline) for deadline, index in ending)
+    key = tuple((index, (deadline - now).days) for index, deadline in live)
+    view = current.views.get(key)
+    cache_total.inc('view', 'miss' if view is None else 'hit')
+    if view is None:
+        # A memo of a pure function of the snapshot, racing requests at worst compute it twice
+        view = make_view([replace(current.contests[index], days_until=days_until) for index, days_until in key])
+        current.views.clear()
+        current.views[key] = view
+    return view
+
+
+def contests_delta(old_contests, new_contests):
+    """The contests added and changed (as (old, new) pairs) going from old to new, and the names removed."""
+    old_by_name = {contest.name: contest for contest in old_contests}
+    new_names = set(contest.name for contest in new_contests)
+    return (tuple(contest for contest in new_contests if contest.name not in old_by_name),
+            tuple((old_by_name[contest.name], contest) for contest in new_contests
+                  if contest.name in old_by_name
+                  and replace(old_by_name[contest.name], days_until=0) != replace(contest, days_until=0)),
+            tuple(contest.name for contest in old_contests if contest.name not in new_names))
+
+
+def deadline_index(entries):
+    return tuple(sorted((deadline, index) for index, (contest, deadline, source_hash) in enumerate(entries)))
+
+
+def make_snapshot(version, entries, last_update_dt=None, previous=None):
+    """
+    Builds the snapshot for a list of (Contest, deadline, source hash) entries in page order.
+    The deltas from the versions in the history of previous are worked out up front, so
+    ?since= requests only need to look them up.
+    """
+    last_update_dt = last_update_dt or datetime.now()
+    contests = tuple(contest for contest, deadline, source_hash in entries)
+    history = ((version, contests),) + tuple((earlier_version, earlier_contests) for earlier_version, earlier_contests
+                                             in (previous.history if previous else ())
+                                             if earlier_version < version)[:DELTA_HISTORY - 1]
+    current = Snapshot(version, contests,
+                       deadline_index(entries),
+                       Meta('', str(last_update_dt.strftime('%Y-%m-%d %H:%M')), last_update_dt,
+                            UPDATE_EVERY, len(entries), version),
+                       {contest.contest_id: source_hash for contest, deadline, source_hash in entries},
+                       {},
+                       history,
+                       {earlier_version: contests_delta(earlier_contests, contests)
+                        for earlier_version, earlier_contests in history})
+    contests_view(current)  # Render today's view before it gets published
+    return current
+
+
+snapshot = make_snapshot(0, [])
+update_condition = threading.Condition()  # Notified whenever a new snapshot has been published
+
+
+def publish_snapshot(entries):
+    """
+    Publishes entries as the next version, unless they hold the same contests as the
+    current snapshot. A scrape that finds nothing new then leaves ETags and waiters alone.
+    """
+    current = snapshot
+    if current.version and current.deadlines == deadline_index(entries) and \
+            unaged(current.contests) == unaged(contest for contest, deadline, source_hash in entries):
+        return current
+    return publish(make_snapshot(current.version + 1, entries, previous=current))
+
+
+def publish(published):
+    global snapshot
+    with update_condition:
+        snapshot = published
+        update_condition.notify_all()
+    return published
+
+
+def save_snapshot(current, next_run):
+    """
+    Persists what's needed to rebuild current and when it will next be updated. Its
+    graphics are already kept in IMAGE_DIR. The file is replaced atomically, so other
+    worker processes reading it always see a complete snapshot. Contests are saved as
+    plain tuples: a pickled Contest names the module it came from, which is __main__
+    or app depending on how the server was started.
+    """
+    deadlines = {index: deadline for deadline, index in current.deadlines}
+    entries = [(astuple(contest), deadlines[index], current.graphics[contest.contest_id])
+               for index, contest in enumerate(current.contests)]
+    with open(f'{SNAPSHOT_FILE}.{os.getpid()}.tmp', 'wb') as f:
+        pickle.dump((current.version, current.meta.last_update_dt, entries, next_run), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{SNAPSHOT_FILE}.{os.getpid()}.tmp', SNAPSHOT_FILE)
+
+
+def load_snapshot():
+    """
+    Rebuilds the last saved snapshot, returning it with the time of its next update,
+    or returns None if there is none that can be used.
+    """
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            version, last_update_dt, entries, next_run = pickle.load(f)
+        if not version:  # Saved by an older version of this file before any scrape succeeded
+            print('No saved contest data loaded (none was scraped)')
+            return None
+        entries = [(Contest(*contest), deadline, source_hash) for contest, deadline, source_hash in entries]
+        return make_snapshot(version, entries, last_update_dt, snapshot), next_run
+    except Exception as e:  # Missing, or written by an incompatible version of this file
+        print(f'No saved contest data loaded ({e})')
+        return None
+
+
+leader_lock = None  # The open LEADER_LOCK_FILE while this process is the one scraping
+
+
+def acquire_leader_lock():
+    global leader_lock
+    if leader_lock or not fcntl:
+        return True
+    lock_file = open(LEADER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:  # Another worker process holds it
+        lock_file.close()
+        return False
+    leader_lock = lock_file  # Kept open, the lock is released when this process exits
+    return True
+
+
+def history_connection():
+    """
+    Opens HISTORY_FILE, creating its tables the first time. Samples are keyed by
+    (contest_id, ts), so the rows of one contest are read in time order straight
+    off the primary key. WAL lets other workers read while one writes, and with it
+    synchronous=NORMAL makes the small writes of device check-ins cheap.
+    """
+    connection = sqlite3.connect(HISTORY_FILE, timeout=10)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS entry_counts ('
+                       'contest_id TEXT NOT NULL, ts INTEGER NOT NULL, entry_count INTEGER NOT NULL, '
+                       'PRIMARY KEY (contest_id, ts)) WITHOUT ROWID')
+    connection.execute('CREATE TABLE IF NOT EXISTS check_ins ('
+                       'device TEXT PRIMARY KEY, seen REAL NOT NULL, route TEXT NOT NULL, next_refresh REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS check_ins_seen ON check_ins (seen)')
+    return connection
+
+
+def parse_entry_count(entry_count):
+    """The number in an entry count as shown on the contest page, None when there isn't one."""
+    digits = ''.join(character for character in entry_count if character.isdigit())
+    return int(digits) if digits else None
+
+
+def record_history(current):
+    """Appends the entry count of each contest in current to HISTORY_FILE."""
+    ts = int(current.meta.last_update_dt.timestamp())
+    samples = [(contest.contest_id, ts, parse_entry_count(contest.entry_count))
+               for contest in current.contests]
+    connection = history_connection()
+    try:
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO entry_counts VALUES (?, ?, ?)',
+                                   [sample for sample in samples if sample[2] is not None])
+    finally:
+        connection.close()
+
+
+def entry_count_history(contest_id, start, end, points):
+    """
+    The entry counts of a contest between start and end (Unix times), downsampled to
+    at most points (ts, entry_count) pairs: the last sample in each of points equal
+    spans of time. Returns the span in seconds with the pairs, or None when there are
+    no samples.
+    """
+    connection = history_connection()
+    try:
+        first, last = connection.execute('SELECT MIN(ts), MAX(ts) FROM entry_counts '
+                                         'WHERE contest_id = ? AND ts BETWEEN ? AND ?',
+                                         (contest_id, start, end)).fetchone()
+        if first is None:
+            return None
+        bucket_seconds = max(1, math.ceil((last - first + 1) / points))
+        # SQLite returns the other columns from the row where MAX() found its value
+        series = connection.execute('SELECT MAX(ts), entry_count FROM entry_counts '
+                                    'WHERE contest_id = ? AND ts BETWEEN ? AND ? '
+                                    'GROUP BY (ts - ?) / ? ORDER BY 1',
+                                    (contest_id, first, last, first, bucket_seconds)).fetchall()
+    finally:
+        connection.close()
+    return bucket_seconds, series
+
+
+def number_arg(name, default, type=int):
+    """?name= converted by type, default when it isn't given, or a 400 when it isn't a finite number."""
+    if name not in request.args:
+        return default
+    value = request.args.get(name, type=type)
+    if value is None or not math.isfinite(value):
+        abort(400, f'{name} must be a number')
+    return value
+
+
+def request_wire_format():
+    """The wire format named by ?format=, or else the one the Accept header prefers, JSON by default."""
+    if 'format' in request.args:
+        if request.args['format'] not in WIRE_FORMATS:
+            abort(400, f'Unknown format, expected one of {", ".join(WIRE_FORMATS)}')
+        return request.args['format']
+    mimetype = request.accept_mimetypes.best_match(list(WIRE_FORMATS.values()), WIRE_FORMATS['json'])
+    return next(name for name, format_mimetype in WIRE_FORMATS.items() if format_mimetype == mimetype)
+
+
+def request_fields():
+    """
+    Returns the contest fields and graphic variant the request selected, either by
+    naming a device profile (?profile=pyportal) or listing them (?fields=name,date).
+    contest_graphic_uri points at the variant named by ?variant=, or else the one
+    of the same name as the profile, if any. The fields are None when the request
+    selected none and the default variant.
+    """
+    variant = request.args.get('variant')
+    if variant is not None and variant not in RENDITIONS:
+        abort(400, f'Unknown variant, expected one of {", ".join(RENDITIONS)}')
+    if 'profile' in request.args:
+        if request.args['profile'] not in PROFILES:
+            abort(400, f'Unknown profile, expected one of {", ".join(PROFILES)}')
+        profile = request.args['profile']
+        return PROFILES[profile], variant or (profile if profile in RENDITIONS else DEFAULT_VARIANT)
+    if 'fields' in request.args:
+        requested = request.args['fields'].split(',')
+        unknown = [name for name in requested if name not in CONTEST_FIELDS]
+        if unknown:
+            abort(400, f'Unknown fields {", ".join(unknown)}, expected any of {", ".join(CONTEST_FIELDS)}')
+        return tuple(name for name in CONTEST_FIELDS if name in requested), variant or DEFAULT_VARIANT
+    if variant and variant != DEFAULT_VARIANT:
+        return CONTEST_FIELDS, variant
+    return None, DEFAULT_VARIANT
+
+
+def contests_payload(view, wire_format=None):
+    """
+    Returns the payload of view for the fields the request selected (see
+    request_fields()) in wire_format, or else the one it asked for. Profiles are
+    serialized in every format when the view is made, other field selections on first use.
+    """
+    wire_format = wire_format or request_wire_format()
+    projected_fields, variant = request_fields()
+    if projected_fields is None:
+        if wire_format == 'json':
+            return view.payload
+        projected_fields = CONTEST_FIELDS
+
+    payload = view.projections.get((projected_fields, variant, wire_format))
+    cache_total.inc('projection', 'miss' if payload is None else 'hit')
+    if payload is None:
+        payload = make_projection(view.contests, projected_fields, variant, wire_format)
+        view.projections[(projected_fields, variant, wire_format)] = payload
+    return payload
+
+
+def delta_body(current, view, since):
+    """
+    Answers ?since= with what changed in the contests since that version: the added
+    and changed contests in the selected fields, the names removed, and the names and
+    days_until of all live contests in order, since the countdowns tick over daily
+    without a new version. Added and changed contests are taken from view, so they
+    count down the same as the rest. A version older than DELTA_HISTORY, or unknown,
+    gets all the contests instead, marked full. Deltas are always JSON.
+    """
+    projected_fields, variant = request_fields()
+    if since not in current.deltas:
+        return b'{"contests":' + contests_payload(view, 'json').body \
+               + b',"full":true,"version":' + str(current.version).encode() + b'}'
+
+    key = (since, projected_fields, variant)
+    delta = view.deltas.get(key)
+    cache_total.inc('delta', 'miss' if delta is None else 'hit')
+    if delta is None:
+        added, changed, removed = current.deltas[since]
+        live_by_name = {contest.name: contest for contest in view.contests}
+        if projected_fields is None:
+            delta = {'added': [live_by_name[contest.name] for contest in added if contest.name in live_by_name],
+                     'changed': [live_by_name[new.name] for old, new in changed if new.name in live_by_name],
+                     'removed': list(removed)}
+        else:
+            # A change to a field the request didn't select isn't a change as far as it's concerned
+            visible = tuple(name for name in projected_fields if name != 'days_until')
+            delta = {'added': [dict(zip(projected_fields,
+                                        project_contest(live_by_name[contest.name], projected_fields, variant)))
+                               for contest in added if contest.name in live_by_name],
+                     'changed': [dict(zip(projected_fields,
+                                          project_contest(live_by_name[new.name], projected_fields, variant)))
+                                 for old, new in changed if new.name in live_by_name
+                                 and project_contest(old, visible, variant) != project_contest(new, visible, variant)],
+                     'removed': list(removed)}
+        with app.app_context():
+            delta = flask_json.dumps(delta, separators=(',', ':')).encode('utf-8')
+        view.deltas[key] = delta
+    live = {'days_until': [contest.days_until for contest in view.contests],
+            'full': False,
+            'names': [contest.name for contest in view.contests],
+            'since': since,
+            'version': current.version}
+    return delta[:-1] + b',' + flask_json.dumps(live, separators=(',', ':')).encode('utf-8')[1:]
+
+
+@dataclass
+class ContestPage:
+    etag: str
+    last_modified: str
+    banners: list  # (name, deadline, contest_uri, contest_graphic_uri, entry_count) as parsed from the page
+
+
+contest_page = ContestPage(None, None, [])
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Returns the shared session for the host of url so connections are kept alive
+    and reused between fetches, including by the image download threads.
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    with sessions_lock:
+        if host not in sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=IMAGE_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            sessions[host] = session
+        return sessions[host]
+
+
+def fetch(url, etag=None, last_modified=None):
+    """
+    GETs url through the pooled session for its host. Passing the validators of a
+    previous response makes the request conditional, in which case a 304 response
+    means the previous content is still current.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return get_session(url).get(url, headers=headers, timeout=FETCH_TIMEOUT)
+
+
+def load_image_cache():
+    try:
+        with open(IMAGE_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_image_cache(cache):
+    with open(IMAGE_CACHE_FILE + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(IMAGE_CACHE_FILE + '.tmp', IMAGE_CACHE_FILE)
+
 
+image_cache = load_image_cache()
 
-meta = Meta('', '', datetime.now(), UPDATE_EVERY, 0)
 
+def centered_clip(image_size, size):
+    """The largest box centered on an image of image_size with the aspect ratio of size."""
+    width, height = image_size
+    clip_width, clip_height = min(width, height * size[0] // size[1]), min(height, width * size[1] // size[0])
+    left, upper = (width - clip_width) // 2, (height - clip_height) // 2
+    return left, upper, left + clip_width, upper + clip_height
 
-def convert_image_url_to_small(url):
-    r = requests.get(url)
-    if r.status_code == 200:
-        image_file = io.BytesIO(r.content)
-        im = Image.open(image_file)
-        im_reduced = im.crop((*pyportal_clip_upper_left, *pyportal_clip_lower_right)) \
-            .resize(pyportal_size)
+
+def fixed_palette(colors):
+    """
+    A palette image of an even RGB cube with up to colors entries, filled out with grays,
+    made once per size. The cube with the most entries wins, more levels of blue breaking
+    ties, so 256 colors is 8 levels of red and green by 4 of blue (3-3-2) with no grays.
+    """
+    if colors not in fixed_palettes:
+        levels = max(((red, green, blue) for red in range(1, 9) for green in range(1, 9) for blue in range(1, 9)
+                      if red * green * blue <= colors and blue <= red <= green),
+                     key=lambda cube: (cube[0] * cube[1] * cube[2], cube[2]))
+        steps = [[255 * step // max(1, count - 1) for step in range(count)] for count in levels]
+        palette = [level for red in steps[0] for green in steps[1] for blue in steps[2] for level in (red, green, blue)]
+        grays = colors - len(palette) // 3
+        palette += [255 * step // (grays + 1) for step in range(1, grays + 1) for _ in range(3)]
+        palette_image = Image.new('P', (1, 1))
+        palette_image.putpalette(palette + palette[-3:] * (256 - colors))
+        fixed_palettes[colors] = palette_image
+    return fixed_palettes[colors]
+
+
+fixed_palettes = {}
+
+
+def render_variant(im, rendition, clip, fast=False):
+    if fast:
+        im_reduced = im.resize(rendition.size, box=clip)
+    else:
+        im_reduced = im.crop(clip).resize(rendition.size)
+    if rendition.text_box:
         draw = ImageDraw.Draw(im_reduced)
-        draw.rectangle([(20, 195), (300, 235)], fill=(0, 0, 0), outline=(255, 255, 255))
-        im_reduced = im_reduced.convert(mode="P", palette=Image.ADAPTIVE, colors=256)
-        im.close()
-        return im_reduced
-    return None
+        draw.rectangle(rendition.text_box, fill=(0, 0, 0), outline=(255, 255, 255))
+    if rendition.grayscale:
+        return im_reduced.convert('L').convert('RGB').quantize(colors=rendition.colors, palette=GRAY_PALETTE,
+                                                               dither=Image.FLOYDSTEINBERG)
+    if fast and rendition.colors >= 64:  # Fewer colors can't be spread evenly, and are quick to fit to small sizes
+        return im_reduced.quantize(colors=rendition.colors, palette=fixed_palette(rendition.colors),
+                                   dither=Image.FLOYDSTEINBERG)
+    return im_reduced.convert(mode="P", palette=Image.ADAPTIVE, colors=rendition.colors)
+
+
+def render_variants(content, variants=RENDITIONS, mode=None):
+    """Decodes a banner once and renders each of the named graphic variants from it."""
+    fast = (mode or CONVERT_MODE) == 'fast'
+    image_file = io.BytesIO(content)
+    im = Image.open(image_file)
+    full_size = im.size
+    clips = {variant: RENDITIONS[variant].clip or centered_clip(full_size, RENDITIONS[variant].size)
+             for variant in variants}
+    if fast:
+        # A JPEG can be decoded at 1/2, 1/4 or 1/8 scale, as long as every clip keeps at least its variant's size
+        scale = min(min((clip[2] - clip[0]) / RENDITIONS[variant].size[0],
+                        (clip[3] - clip[1]) / RENDITIONS[variant].size[1]) for variant, clip in clips.items())
+        if scale > 1:
+            im.draft('RGB', (math.ceil(full_size[0] / scale), math.ceil(full_size[1] / scale)))
+        if im.mode != 'RGB':
+            im = im.convert('RGB')
+    im.load()
+    if im.size != full_size:
+        x_scale, y_scale = im.size[0] / full_size[0], im.size[1] / full_size[1]
+        clips = {variant: (clip[0] * x_scale, clip[1] * y_scale, clip[2] * x_scale, clip[3] * y_scale)
+                 for variant, clip in clips.items()}
+    rendered = {variant: render_variant(im, RENDITIONS[variant], clip, fast) for variant, clip in clips.items()}
+    im.close()
+    return rendered
+
+
+def source_fname(source_hash):
+    return IMAGE_DIR + source_hash + '.banner'
+
+
+class ImageLRU:
+    """Rendered graphics keyed by (source hash, variant), evicting the least recently used past max_bytes."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
 
+    def put(self, key, image):
+        with self.lock:
+            if key not in self.images:
+                self.size += len(image)
+            self.images[key] = image
+            while self.size > self.max_bytes and len(self.images) > 1:
+                self.size -= len(self.images.popitem(last=False)[1])
 
-def update_contests():
-    page = requests.get(URL)
-    soup = BeautifulSoup(page.content, 'html.parser')
-    results = soup.find(id='cur-contests')
+
+image_lru = ImageLRU(IMAGE_LRU_BYTES)
+
+
+def rendered_image(source_hash, variant, mode=None):
+    """Returns the BMP bytes of variant rendered from a saved banner source, rendering it on first use."""
+    mode = mode or CONVERT_MODE
+    image = image_lru.get((source_hash, variant, mode))
+    cache_total.inc('image_lru', 'miss' if image is None else 'hit')
+    if image is None:
+        with open(source_fname(source_hash), 'rb') as f:
+            content = f.read()
+        with scrape_seconds.time('image_convert'):
+            rendered = render_variants(content, [variant], mode)[variant]
+        with scrape_seconds.time('image_save'):
+            image_file = io.BytesIO()
+            rendered.save(image_file, 'BMP')
+            image = image_file.getvalue()
+        image_lru.put((source_hash, variant, mode), image)
+    return image
+
+
+def save_contest_source(contest_graphic_uri):
+    """
+    Makes sure the banner at contest_graphic_uri is saved as a source for rendering
+    graphics and returns its cache entry. A banner already saved from the same URI is
+    only revalidated (or not downloaded at all if the server gave no validators), and
+    sources are named by content hash, so a banner is only stored once.
+    """
+    entry = image_cache.get(contest_graphic_uri)
+    if entry and os.path.exists(source_fname(entry['sha256'])):
+        if not entry.get('etag') and not entry.get('last_modified'):
+            cache_total.inc('image_source', 'hit')
+            return entry
+        with scrape_seconds.time('image_download'):
+            r = fetch(contest_graphic_uri, entry.get('etag'), entry.get('last_modified'))
+        if r.status_code == 304:
+            cache_total.inc('image_source', 'hit')
+            return entry
+    else:
+        with scrape_seconds.time('image_download'):
+            r = fetch(contest_graphic_uri)
+    cache_total.inc('image_source', 'miss')
+    if r.status_code != 200:
+        print(f'Failed to download {contest_graphic_uri}: HTTP {r.status_code}')
+        return None
+    source_hash = hashlib.sha256(r.content).hexdigest()
+    if not os.path.exists(source_fname(source_hash)):
+        with open(source_fname(source_hash) + '.tmp', 'wb') as f:
+            f.write(r.content)
+        os.replace(source_fname(source_hash) + '.tmp', source_fname(source_hash))
+    return {'sha256': source_hash, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+
+def evict_contest_images(keep):
+    """Removes saved banner sources that aren't in keep, along with graphics converted by earlier versions."""
+    for fname in os.listdir(IMAGE_DIR):
+        if fname.endswith('.bmp') or (fname.endswith('.banner') and IMAGE_DIR + fname not in keep):
+            os.remove(IMAGE_DIR + fname)
+
+
+def parse_contest_page(content, mode=None, previous=()):
+    """
+    Returns a (name, deadline, contest_uri, contest_graphic_uri, entry_count) banner for each
+    contest on the page. A banner that can't be parsed is logged and left out, or replaced
+    by the one of the same name in previous, the banners parsed last time.
+    """
+    if (mode or PARSE_MODE) == 'full':
+        soup = BeautifulSoup(content, 'html.parser')
+        results = soup.find(id='cur-contests')
+    else:
+        results = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(id='cur-contests'))
     contest_banners = results.find_all('div', class_='contest-banner')
 
-    contests = []
+    previous_by_name = {banner[0]: banner for banner in previous}
+    banners = []
     for contest in contest_banners:
-        contest_name = contest.find('img')['alt']
-        contest_deadline = contest.find('span', class_='contest-meta-deadline')['data-deadline']
-        deadline = datetime.fromisoformat(contest_deadline)
+        contest_name = None
+        try:
+            img = contest.find('img')
+            contest_name = img['alt']
+            contest_deadline = contest.find('span', class_='contest-meta-deadline')['data-deadline']
+            deadline = datetime.fromisoformat(contest_deadline)
+            contest_uri = urllib.parse.quote('https://www.instructables.com' + contest.find('a')['href'], safe='/:')
+            contest_graphic_uri = img['src']
+            entry_count = contest.find_all('span', class_='contest-meta-count')[1].text
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:  # Missing or malformed markup
+            print(f'Failed to parse the banner of {contest_name or "a contest"}: {e!r}')
+            if contest_name in previous_by_name:
+                banners.append(previous_by_name[contest_name])
+            continue
+        banners.append((contest_name, deadline, contest_uri, contest_graphic_uri, entry_count))
+    return banners
+
+
+def contest_entry(banner, source_hash):
+    contest_name, deadline_formatted, days_until, contest_uri, entry_count, deadline = banner
+    return (Contest(contest_name, deadline_formatted,
+                    days_until, contest_uri,
+                    contest_graphic_path(contest_name, source_hash), entry_count, contest_slug(contest_name)),
+            deadline, source_hash)
+
+
+def last_good_source(contest_name, contest_graphic_uri):
+    """The hash of the last banner saved for a contest, or None if there is no such banner left."""
+    entry = image_cache.get(contest_graphic_uri)
+    source_hash = entry['sha256'] if entry else snapshot.graphics.get(contest_slug(contest_name))
+    return source_hash if source_hash and os.path.exists(source_fname(source_hash)) else None
+
+
+def update_contests(publish=None):
+    """
+    Scrapes the current contests, returning a (Contest, deadline, source hash) entry for
+    each in page order. When given, publish is called with the entries as soon as the
+    page is parsed, pointing at the banners saved last time, and again each time a
+    banner download changes one of them. A banner that fails to download keeps the
+    one saved last time.
+    """
+    with scrape_seconds.time('page_fetch'):
+        page = fetch(URL, contest_page.etag, contest_page.last_modified)
+    cache_total.inc('page', 'hit' if page.status_code == 304 else 'miss')
+    if page.status_code != 304:  # Not modified, the banners parsed last time are still current
+        page.raise_for_status()
+        with scrape_seconds.time('parse'):
+            contest_page.banners = parse_contest_page(page.content, previous=contest_page.banners)
+        contest_page.etag = page.headers.get('ETag')
+        contest_page.last_modified = page.headers.get('Last-Modified')
+
+    banners = []
+    images = []
+    for contest_name, deadline, contest_uri, contest_graphic_uri, entry_count in contest_page.banners:
         if deadline < datetime.now():
             continue
         deadline_formatted = deadline.strftime('%B %d')
         delta = deadline - datetime.now()
         days_until = delta.days
-        contest_uri = urllib.parse.quote('https://www.instructables.com' + contest.find('a')['href'], safe='/:')
-        contest_graphic_uri = contest.find('img')['src']
-        image = convert_image_url_to_small(contest_graphic_uri)
-        image_fname = urllib.parse.quote('static/contestImg/'
-                                         + contest_name.replace(" ", "")
-                                         .replace("#", "")
-                                         .replace("&", "")
-                                         + '.bmp')
-        image.save(image_fname, 'BMP')
-        entry_count = contest.find_all('span', class_='contest-meta-count')[1].text
-        contest_entry = Contest(contest_name, deadline_formatted,
-                                days_until, contest_uri,
-                                image_fname, entry_count)
-        contests.append(contest_entry)
+        banners.append((contest_name, deadline_formatted, days_until, contest_uri, entry_count, deadline))
+        images.append(contest_graphic_uri)
+
+    contests = [contest_entry(banner, last_good_source(banner[0], contest_graphic_uri))
+                for banner, contest_graphic_uri in zip(banners, images)]
+    if publish:
+        publish(list(contests))
+
+    # Banners are downloaded in parallel and published as each one finishes. Graphics are
+    # only rendered from them when a device asks for one.
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+        downloads = {pool.submit(save_contest_source, contest_graphic_uri): index
+                     for index, contest_graphic_uri in enumerate(images)}
+        for download in as_completed(downloads):
+            index = downloads[download]
+            try:
+                source = download.result()
+            except Exception as e:  # Timed out or cut off, keep the last banner
+                print(f'Failed to download {images[index]}: {e}')
+                source = None
+            if not source:
+                continue
+            image_cache[images[index]] = source
+            if source['sha256'] != contests[index][2]:
+                contests[index] = contest_entry(banners[index], source['sha256'])
+                if publish:
+                    publish(list(contests))
+
+    # Only sources for contests still on the page are kept, everything else is evicted
+    for contest_graphic_uri in set(image_cache) - set(images):
+        del image_cache[contest_graphic_uri]
+    save_image_cache(image_cache)
+    evict_contest_images([source_fname(source_hash) for contest, deadline, source_hash in contests if source_hash])
     return contests
 
 
-def setup_server(meta_data, contests_data):
-    def contest_update(meta_data, contests_data):
+def unaged(contests):
+    """The contests without the days_until they were scraped with, for comparing them."""
+    return [replace(contest, days_until=0) for contest in contests]
+
+
+def same_contests(previous, current):
+    """True when two snapshots hold the same contests, ignoring the days_until they were scraped with."""
+    return previous.deadlines == current.deadlines and unaged(previous.contests) == unaged(current.contests)
+
+
+class RefreshScheduler:
+    """
+    Decides when the next contest update runs. The interval starts at UPDATE_EVERY,
+    doubles for every consecutive update that found nothing new (up to
+    MAX_UPDATE_EVERY), shrinks to half the time left before the closest deadline
+    (down to MIN_UPDATE_EVERY) and is jittered by UPDATE_JITTER. trigger() runs
+    the next update right away.
+    """
+    def __init__(self):
+        self.unchanged = 0
+        self.next_run = datetime.now()
+        self.wakeup = threading.Event()
+
+    def interval_minutes(self, current):
+        minutes = min(UPDATE_EVERY * 2 ** self.unchanged, MAX_UPDATE_EVERY)
+        now = datetime.now()
+        upcoming = current.deadlines[bisect.bisect_left(current.deadlines, (now,)):]
+        if upcoming:
+            minutes = min(minutes, (upcoming[0][0] - now).total_seconds() / 60 / 2)
+        minutes *= random.uniform(1 - UPDATE_JITTER, 1 + UPDATE_JITTER)
+        return max(minutes, MIN_UPDATE_EVERY)
+
+    def schedule(self, previous, current):
+        self.unchanged = self.unchanged + 1 if same_contests(previous, current) else 0
+        self.next_run = datetime.now() + timedelta(minutes=self.interval_minutes(current))
+
+    def retry(self):
+        self.next_run = datetime.now() + timedelta(minutes=MIN_UPDATE_EVERY)
+
+    def wait(self):
+        """Waits for the next run, for trigger() or for another worker to create REFRESH_FILE."""
+        while datetime.now() < self.next_run and not self.wakeup.is_set():
+            remaining = (self.next_run - datetime.now()).total_seconds()
+            self.wakeup.wait(max(min(remaining, SHARED_POLL_SECONDS), 0))
+            try:
+                os.remove(REFRESH_FILE)
+                break
+            except FileNotFoundError:
+                pass
+        self.wakeup.clear()
+
+    def trigger(self):
+        self.next_run = datetime.now()
+        self.wakeup.set()
+
+
+scheduler = RefreshScheduler()
+
+
+def setup_server():
+    def contest_update():
         print('Updating contest data')
-        contests_data.contests = update_contests()
-        meta_data.last_update_dt = datetime.now()
-        meta_data.last_update = str(meta_data.last_update_dt.strftime('%Y-%m-%d %H:%M'))
-        print(f'Contest data loaded: {meta_data.last_update}')
-        meta_data.contest_count = len(contests_data.contests)
+        previous = snapshot
+        with scrape_seconds.time('total'):
+            update_contests(publish_snapshot)
+        published = snapshot
+        scheduler.schedule(previous, published)
+        save_snapshot(published, scheduler.next_run)
+        record_history(published)
+        print(f'Contest data loaded: {published.meta.last_update}')
+
+    def try_contest_update():
+        try:
+            contest_update()
+        except Exception as e:  # Keep serving the current snapshot and try again later
+            print(f'Contest update failed: {e}')
+            scheduler.retry()
+            if snapshot.version:  # Before the first scrape succeeds there are no contests worth saving
+                save_snapshot(snapshot, scheduler.next_run)
 
-    def contest_update_job(meta_data, contests_data):
+    def contest_update_job():
         while True:
-            print(f'Waiting {UPDATE_EVERY} minutes for next contest update')
-            time.sleep(UPDATE_EVERY * 60)  # sleep for two hours
-            contest_update(meta_data, contests_data)
+            print(f'Waiting until {scheduler.next_run:%Y-%m-%d %H:%M} for next contest update')
+            scheduler.wait()
+            try_contest_update()
+
+    def follow_job():
+        """Serves the snapshots another worker saves until this one can take over scraping."""
+        saved_mtime = None
+        while not acquire_leader_lock():
+            try:
+                mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != saved_mtime:
+                saved_mtime = mtime
+                restore_saved()
+            time.sleep(SHARED_POLL_SECONDS)
+        print('Scraping contest data in this worker')
+        restore_saved()
+        image_cache.clear()  # The last leader's, this worker's is as old as its import
+        image_cache.update(load_image_cache())
+        contest_update_job()
 
-    contest_update(meta_data, contests_data)
-    thread = threading.Thread(target=contest_update_job, args=(meta_data, contests_data,), daemon=True)
+    def restore_saved():
+        saved = load_snapshot()
+        if saved and saved[0].version >= snapshot.version:
+            scheduler.next_run = saved[1]
+            if saved[0].version > snapshot.version:
+                publish(saved[0])
+        return saved
+
+    def after_fork():
+        """
+        A worker forked from a process that already ran this (gunicorn --preload)
+        inherits leader_lock but not the threads. The lock stays with the process
+        that took it, so the worker follows it, and takes over if it exits. Any
+        thread lock a scrape held at the fork would stay locked with no thread
+        left to release it, so the worker makes its own, and its own connections.
+        """
+        global leader_lock, update_condition, sessions_lock
+        if leader_lock:
+            leader_lock.close()
+            leader_lock = None
+        update_condition = threading.Condition()
+        sessions_lock = threading.Lock()
+        sessions.clear()  # Their pooled sockets are shared with the parent
+        for metric in metrics:
+            metric.lock = threading.Lock()
+        image_lru.lock = threading.Lock()
+        fleet.local = threading.local()
+        scheduler.wakeup = threading.Event()
+        threading.Thread(target=follow_job, daemon=True).start()
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=after_fork)
+
+    # Serve the last saved contests right away and update them in the background,
+    # only a first start has to wait for Instructables. If it can't be reached, the
+    # server starts with no contests and the background job tries again.
+    saved = restore_saved()
+    if saved:
+        print(f'Saved contest data loaded: {saved[0].meta.last_update}')
+    if acquire_leader_lock():
+        if not saved:
+            try_contest_update()
+        thread = threading.Thread(target=contest_update_job, daemon=True)
+    else:
+        thread = threading.Thread(target=follow_job, daemon=True)
     thread.start()
 
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(time.perf_counter() - g.request_start, route)
+    requests_total.inc(route, response.status_code)
+    if request.args.get('device'):
+        fleet.check_in(request.args['device'], route, g.get('next_refresh'))
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    current = snapshot
+    lines = ['# HELP contest_snapshot_age_seconds Seconds since a scrape last changed the served contests',
+             '# TYPE contest_snapshot_age_seconds gauge',
+             f'contest_snapshot_age_seconds {(datetime.now() - current.meta.last_update_dt).total_seconds():.3f}',
+             '# HELP contest_snapshot_version Version of the served snapshot',
+             '# TYPE contest_snapshot_version gauge',
+             f'contest_snapshot_version {current.version}']
+    lines.extend(['# HELP contest_devices Devices that checked in within DEVICE_FORGET',
+                  '# TYPE contest_devices gauge',
+                  f'contest_devices {fleet.count()}'])
+    for metric in metrics:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def page_last_modified(current, view):
+    """
+    When the contests shown in view last changed: the update that made current, or
+    when view was made if a contest has ended or a countdown ticked over since.
+    """
+    if [contest.days_until for contest in view.contests] == [contest.days_until for contest in current.contests]:
+        return current.meta.last_update_dt
+    return max(current.meta.last_update_dt, view.made)
+
+
 @app.route('/')
 def index():
-    return render_template('index.html', contests=contests.contests)
+    """
+    The contests as a web page. It's rendered once per view, which lives on the
+    snapshot, so a new snapshot or a new day renders it again.
+    """
+    current = snapshot  # Read once, so the page and Last-Modified come from the same snapshot
+    view = contests_view(current)
+    page = view.pages.get('index.html')
+    cache_total.inc('index', 'miss' if page is None else 'hit')
+    if page is None:
+        page = encoded_payload(render_template('index.html', contests=view.contests).encode('utf-8'),
+                               'text/html')
+        view.pages['index.html'] = page
+    return payload_response(page, page_last_modified(current, view))
+
+
+@app.route('/api/v1/image/<contest>/<variant>', methods=['GET'])
+def get_image(contest, variant):
+    """
+    A contest graphic rendered for a device, see RENDITIONS for the variants. contest is the
+    slug of its name, followed by the start of its banner source hash, and variant is
+    followed by the conversion mode in the URIs handed out by contest_graphic_path().
+    Those never change content and so are cached for good. The ETag is a hash of the
+    bytes served, so a different Pillow rendering them differently changes it too.
+    """
+    slug, _, version = contest.rpartition('.')
+    if len(version) != GRAPHIC_VERSION_LENGTH:
+        slug, version = contest, ''
+    variant, _, mode = variant.partition('-')
+    source_hash = snapshot.graphics.get(slug)
+    if variant not in RENDITIONS or (mode and mode not in CONVERT_MODES) or \
+            not source_hash or not source_hash.startswith(version):
+        abort(404)
+    try:
+        image = rendered_image(source_hash, variant, mode)
+    except OSError:  # The source was evicted by a newer snapshot, or couldn't be decoded
+        abort(404)
+    response = Response(image, mimetype='image/bmp')
+    response.set_etag(hashlib.sha256(image).hexdigest()[:32])
+    if version and mode:
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_MAX_AGE
+    # Devices resume an interrupted download with a Range request for the rest of it
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(image))
 
 
 @app.route('/api/v1/contests', methods=['GET'])
 def get_contests():
-    return jsonify(contests.contests)
+    if 'since' in request.args:
+        since = number_arg('since', None)
+        if request_wire_format() != 'json':
+            abort(400, 'Deltas are only available as JSON')
+        current = snapshot  # Read once, so the delta and the view come from the same snapshot
+        return Response(delta_body(current, contests_view(current), since), mimetype='application/json')
+    return payload_response(contests_payload(contests_view(snapshot)))
+
+
+def device_jitter(device):
+    """Seconds into REFRESH_WINDOW a device refreshes, spread evenly over devices and the same on every request."""
+    return int.from_bytes(hashlib.sha256(device.encode('utf-8')).digest()[:4], 'big') * REFRESH_WINDOW // 2 ** 32
+
+
+class Fleet:
+    """
+    The last check-in of every device that names itself with ?device=, and when it
+    was told to refresh next, so the refresh load they put on the server can be
+    reported. Check-ins are kept in HISTORY_FILE, so every worker process reports
+    the whole fleet. Each one counts the requests it answers in check_ins_total.
+    """
+    def __init__(self):
+        self.local = threading.local()  # A connection to HISTORY_FILE per thread
+        self.pruned = 0  # When this process last forgot devices
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = history_connection()
+        return self.local.connection
+
+    def check_in(self, device, route, next_refresh):
+        check_ins_total.inc(route)
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO check_ins VALUES (?, ?, ?, ?)',
+                               (device, now, route, next_refresh.timestamp() if next_refresh else None))
+            # Devices gone quiet are forgotten, and the longest silent past DEVICE_LIMIT. Doing it every
+            # few seconds keeps it off most requests, and the table can only grow by what arrives meanwhile.
+            if now - self.pruned > SHARED_POLL_SECONDS:
+                self.pruned = now
+                connection.execute('DELETE FROM check_ins WHERE seen < ? OR seen <= '
+                                   '(SELECT seen FROM check_ins ORDER BY seen DESC LIMIT 1 OFFSET ?)',
+                                   (now - DEVICE_FORGET, DEVICE_LIMIT))
+
+    def count(self):
+        return self.connection().execute('SELECT COUNT(*) FROM check_ins WHERE seen >= ?',
+                                         (time.time() - DEVICE_FORGET,)).fetchone()[0]
+
+    def report(self):
+        now = datetime.now()
+        rows = self.connection().execute('SELECT device, seen, route, next_refresh FROM check_ins '
+                                         'WHERE seen >= ? ORDER BY device LIMIT ?',
+                                         (now.timestamp() - DEVICE_FORGET, DEVICE_LIMIT)).fetchall()
+        devices = {device: (datetime.fromtimestamp(seen), route,
+                            datetime.fromtimestamp(next_refresh) if next_refresh else None)
+                   for device, seen, route, next_refresh in rows}
+        by_minute = {}
+        for seen, route, next_refresh in devices.values():
+            if next_refresh and next_refresh > now:
+                minute = next_refresh.strftime('%Y-%m-%d %H:%M')
+                by_minute[minute] = by_minute.get(minute, 0) + 1
+        return {'devices': {device: {'last_check_in': str(seen.strftime('%Y-%m-%d %H:%M:%S')), 'route': route,
+                                     'next_refresh': str(next_refresh.strftime('%Y-%m-%d %H:%M:%S'))
+                                     if next_refresh else None}
+                            for device, (seen, route, next_refresh) in devices.items()},
+                'check_ins_last_hour': sum(1 for seen, route, next_refresh in devices.values()
+                                           if (now - seen).total_seconds() <= 60 * 60),
+                'refreshes_by_minute': sorted(by_minute.items()),
+                'peak_refreshes_per_minute': max(by_minute.values(), default=0)}
+
+
+fleet = Fleet()
+
+
+def current_meta(current, view):
+    """
+    The meta of current as of this request. refresh_seconds tells the asking device
+    to come back a minute after the next update, plus its own share of
+    REFRESH_WINDOW (by ?device=, or its address), so the fleet doesn't refresh at once.
+    """
+    now = datetime.now()
+    next_run = scheduler.next_run
+    device = request.args.get('device') or request.remote_addr or ''
+    g.next_refresh = max(next_run, now) + timedelta(seconds=60 + device_jitter(device))
+    return replace(current.meta,
+                   current_time=str(now.strftime('%Y-%m-%d %H:%M:%S')),
+                   next_update_minutes=max(math.ceil((next_run - now).total_seconds() / 60), 0),
+                   next_update=str(next_run.strftime('%Y-%m-%d %H:%M:%S')),
+                   contest_count=len(view.contests),
+                   refresh_seconds=math.ceil((g.next_refresh - now).total_seconds()))
+
+
+@app.route('/api/v1/contests/<contest_id>/history', methods=['GET'])
+def get_contest_history(contest_id):
+    """
+    Entry counts of a contest over time, by the contest_id in its contests entry.
+    ?start= and ?end= limit the Unix times returned, ?points= the number of points
+    (HISTORY_POINTS).
+    """
+    start = number_arg('start', 0)
+    end = number_arg('end', 2 ** 62)
+    points = min(max(number_arg('points', HISTORY_POINTS), 1), HISTORY_MAX_POINTS)
+    history = entry_count_history(contest_id, start, end, points)
+    if history is None:
+        abort(404)
+    bucket_seconds, series = history
+    return jsonify({'contest': contest_id, 'bucket_seconds': bucket_seconds, 'series': series})
 
 
 @app.route('/api/v1/meta', methods=['GET'])
 def get_meta():
-    meta.current_time = str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-    meta.next_update_minutes = UPDATE_EVERY - ((datetime.now() - meta.last_update_dt).seconds // 60)
-    return jsonify(meta)
+    current = snapshot
+    return jsonify(current_meta(current, contests_view(current)))
+
+
+@app.route('/api/v1/fleet', methods=['GET'])
+def get_fleet():
+    """The devices that checked in recently and how many of them are due to refresh in each coming minute."""
+    return jsonify(fleet.report())
+
+
+@app.route('/api/v1/snapshot', methods=['GET'])
+def get_snapshot():
+    """
+    The contests and meta in one response, so devices only need a single request per
+    refresh. The ETag is weak since current_time and next_update_minutes change on
+    every request, but a match means no snapshot has been published since. As TSV,
+    the meta table comes first, then a blank line and the contests table.
+    """
+    current = snapshot  # Read once, so payload and meta come from the same snapshot
+    view = contests_view(current)
+    payload = contests_payload(view)
+    snapshot_meta = current_meta(current, view)
+    etag = f'{payload.etag}-{current.version}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif payload.mimetype == WIRE_FORMATS['tsv']:
+        body = tsv_table([meta_field.name for meta_field in fields(Meta)],
+                         [[getattr(snapshot_meta, meta_field.name) for meta_field in fields(Meta)]]) \
+               + b'\n' + payload.body
+        response = Response(body, mimetype=payload.mimetype)
+    else:
+        body = b'{"contests":' + payload.body \
+               + b',"meta":' + flask_json.dumps(snapshot_meta, separators=(',', ':')).encode('utf-8') + b'}'
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    # Also on a 304, so a device revalidating still learns when its turn to refresh is
+    response.cache_control.max_age = snapshot_meta.refresh_seconds
+    response.cache_control.private = True
+    response.vary.add('Accept')
+    return response
+
+
+@app.route('/api/v1/wait', methods=['GET'])
+def wait_for_update():
+    """
+    Long-poll for the next contest update. Blocks until the snapshot version is newer than
+    ?version= and then answers like /api/v1/snapshot (including ?profile= and
+    ?fields=), or answers 204 No Content once ?timeout= seconds pass without one.
+    Waiters sleep on a condition variable, so they cost a connection and a thread
+    but no CPU until an update is published, see the module docstring for workers.
+    """
+    version = number_arg('version', snapshot.version)
+    timeout = min(number_arg('timeout', LONG_POLL_TIMEOUT, float), LONG_POLL_TIMEOUT)
+    with update_condition:
+        updated = update_condition.wait_for(lambda: snapshot.version > version, timeout)
+    if not updated:
+        return Response(status=204)
+    return get_snapshot()
+
+
+@app.route('/api/v1/refresh', methods=['POST'])
+def refresh():
+    """Runs a contest update right away. Requires an Authorization: Bearer REFRESH_TOKEN header."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if not REFRESH_TOKEN or scheme.lower() != 'bearer' or \
+            not hmac.compare_digest(token.encode(), REFRESH_TOKEN.encode()):
+        abort(403)
+    if leader_lock or not fcntl:
+        scheduler.trigger()
+    else:  # Another worker scrapes, ask it to update
+        open(REFRESH_FILE, 'a').close()
+    return jsonify(version=snapshot.version), 202
 
 
-setup_server(meta, contests)
+setup_server()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
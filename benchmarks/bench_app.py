@@ -0,0 +1,177 @@
+"""
+Times the scrape pipeline stage by stage and load tests the Flask routes, all
+against the local stand-in for Instructables, and writes the results as JSON
+so runs can be compared for regressions.
+
+Usage: python benchmarks/bench_app.py [--output FILE] [--compare BASELINE]
+                                      [--repeat N] [--requests N] [--clients N]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+from standin import start_standin, import_app, REPO_ROOT
+
+ROUTES = ('/', '/api/v1/contests', '/api/v1/meta')
+REGRESSION_THRESHOLD = 1.10  # Medians this much slower than the baseline are flagged
+
+
+def summarize(seconds):
+    seconds = sorted(seconds)
+    return {'n': len(seconds),
+            'min_ms': seconds[0] * 1000,
+            'median_ms': statistics.median(seconds) * 1000,
+            'mean_ms': statistics.mean(seconds) * 1000,
+            'p99_ms': seconds[min(len(seconds) - 1, int(len(seconds) * .99))] * 1000,
+            'max_ms': seconds[-1] * 1000}
+
+
+def timed(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def reset_caches(app):
+    """Forgets everything the scraper cached so the next update runs cold."""
+    app.contest_page = app.ContestPage(None, None, [])
+    app.image_cache.clear()
+    app.image_lru = app.ImageLRU(app.IMAGE_LRU_BYTES)
+    for fname in os.listdir(app.IMAGE_DIR):
+        if fname.endswith('.banner'):
+            os.remove(app.IMAGE_DIR + fname)
+
+
+def bench_stages(app, repeat):
+    page = app.fetch(app.URL)
+    content = page.content  # The recorded page with its graphic links pointed at the stand-in
+    banners = app.parse_contest_page(content)
+    sources = [app.fetch(contest_graphic_uri).content for _, _, _, contest_graphic_uri, _ in banners]
+    rendered = app.render_variants(sources[0])
+
+    def cold_pipeline():
+        reset_caches(app)
+        app.update_contests()
+
+    def first_publish():
+        """Seconds a cold update takes to publish the contests, before their banners are in."""
+        reset_caches(app)
+        start = time.perf_counter()
+        published = []
+        app.update_contests(lambda entries: published.append(time.perf_counter() - start))
+        return published[0]
+
+    stages = {
+        'page_fetch': timed(lambda: app.fetch(app.URL), repeat),
+        'page_revalidate': timed(lambda: app.fetch(app.URL, page.headers.get('ETag')), repeat),
+        'parse_full': timed(lambda: app.parse_contest_page(content, 'full'), repeat),
+        'parse_strained': timed(lambda: app.parse_contest_page(content, 'strained'), repeat),
+        'image_download': timed(lambda: [app.fetch(banner[3]) for banner in banners], repeat),
+        'image_convert': timed(lambda: [app.render_variants(source) for source in sources], repeat),
+        'image_save': timed(lambda: [image.save(io.BytesIO(), 'BMP') for image in rendered.values()], repeat),
+        'pipeline_cold': timed(cold_pipeline, max(repeat // 4, 1)),
+        'pipeline_warm': timed(app.update_contests, repeat),
+        'pipeline_first_publish': summarize([first_publish() for _ in range(max(repeat // 4, 1))]),
+    }
+    stages['image_download']['images'] = stages['image_convert']['images'] = len(sources)
+    return stages
+
+
+def bench_routes(app, total_requests, clients):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    def client(route, count):
+        session = requests.Session()
+        seconds = []
+        for _ in range(count):
+            start = time.perf_counter()
+            session.get(base_url + route).raise_for_status()
+            seconds.append(time.perf_counter() - start)
+        return seconds
+
+    routes = {}
+    for route in ROUTES:
+        client(route, 10)  # Warm up
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(client, [route] * clients, [total_requests // clients] * clients))
+        elapsed = time.perf_counter() - start
+        routes[route] = summarize([seconds for result in results for seconds in result])
+        routes[route]['requests_per_second'] = routes[route]['n'] / elapsed
+    server.shutdown()
+    return routes
+
+
+def compare(results, baseline):
+    """Prints every median next to the baseline's, flagging regressions."""
+    for section in ('stages', 'routes'):
+        for name, current in results[section].items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous:
+                continue
+            ratio = current['median_ms'] / previous['median_ms']
+            flag = '  REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+            print(f'{name:>20}: {previous["median_ms"]:9.2f} ms -> {current["median_ms"]:9.2f} ms '
+                  f'({ratio:5.2f}x){flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='JSON file for the results (default benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs of each pipeline stage')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per route in the load test')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients in the load test')
+    args = parser.parse_args()
+    output = args.output or os.path.join(REPO_ROOT, 'benchmarks', 'results',
+                                         f'{datetime.now():%Y%m%d-%H%M%S}.json')
+
+    standin, base_url = start_standin()
+    app = import_app(base_url)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    results = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+               'commit': commit,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'stages': bench_stages(app, args.repeat),
+               'routes': bench_routes(app, args.requests, args.clients)}
+    standin.shutdown()
+
+    for section in ('stages', 'routes'):
+        for name, result in results[section].items():
+            extra = f'  {result["requests_per_second"]:8.0f} req/s' if 'requests_per_second' in result else ''
+            print(f'{name:>20}: median {result["median_ms"]:9.2f} ms  p99 {result["p99_ms"]:9.2f} ms{extra}')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
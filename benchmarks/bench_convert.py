@@ -0,0 +1,62 @@
+"""
+Compares the image conversion modes on the recorded banners in fixtures/,
+timing each mode and measuring how far its graphics are from the banner
+cropped and resized at full quality, before any colors are taken away.
+
+Usage: python benchmarks/bench_convert.py [repeat]
+"""
+import io
+import math
+import os
+import sys
+import timeit
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from standin import start_standin, import_app, read_fixture, FIXTURES
+
+
+def rms(first, second):
+    """Root mean square difference of two images over all their RGB channels, 0 to 255."""
+    stat = ImageStat.Stat(ImageChops.difference(first.convert('RGB'), second.convert('RGB')))
+    return math.sqrt(sum(stat.sum2) / (len(stat.sum2) * first.size[0] * first.size[1]))
+
+
+def reference(app, content, variant):
+    """The banner cropped and resized from a full decode, with no palette applied."""
+    rendition = app.RENDITIONS[variant]
+    im = Image.open(io.BytesIO(content)).convert('RGB')
+    im = im.crop(rendition.clip or app.centered_clip(im.size, rendition.size)).resize(rendition.size)
+    if rendition.text_box:
+        ImageDraw.Draw(im).rectangle(rendition.text_box, fill=(0, 0, 0), outline=(255, 255, 255))
+    if rendition.grayscale:
+        im = im.convert('L')
+    return im
+
+
+def main(repeat=5):
+    server, base_url = start_standin()
+    app = import_app(base_url)
+    sources = [read_fixture(os.path.join('banners', fname))
+               for fname in sorted(os.listdir(os.path.join(FIXTURES, 'banners')))]
+    references = [{variant: reference(app, source, variant) for variant in app.RENDITIONS} for source in sources]
+
+    rendered = {}
+    for mode in ('exact', 'fast'):
+        rendered[mode] = [app.render_variants(source, mode=mode) for source in sources]
+        best = min(timeit.repeat(lambda: [app.render_variants(source, mode=mode) for source in sources],
+                                 number=1, repeat=repeat))
+        print(f'{mode:>10}: {best * 1000 / len(sources):8.2f} ms per banner  ({len(sources)} banners)')
+
+    print(f'\n{"variant":>10}  {"exact rms":>10}  {"fast rms":>10}  {"exact-fast":>10}')
+    for variant in app.RENDITIONS:
+        errors = [[rms(graphics[variant], target[variant]) for graphics, target in zip(rendered[mode], references)]
+                  for mode in ('exact', 'fast')]
+        between = [rms(exact[variant], fast[variant]) for exact, fast in zip(rendered['exact'], rendered['fast'])]
+        print(f'{variant:>10}  ' + '  '.join(f'{sum(values) / len(values):10.2f}'
+                                            for values in (errors[0], errors[1], between)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,27 @@
+"""
+Compares the contest page parse modes on the recorded page in fixtures/.
+
+Usage: python benchmarks/bench_parse.py [repeat]
+"""
+import sys
+import timeit
+
+from standin import start_standin, import_app, read_fixture
+
+
+def main(repeat=20):
+    server, base_url = start_standin()
+    app = import_app(base_url)
+    content = read_fixture('contest_page.html')
+
+    results = {}
+    for mode in ('full', 'strained'):
+        results[mode] = app.parse_contest_page(content, mode)
+        best = min(timeit.repeat(lambda: app.parse_contest_page(content, mode), number=1, repeat=repeat))
+        print(f'{mode:>10}: {best * 1000:8.2f} ms  ({len(results[mode])} banners)')
+    assert results['full'] == results['strained'], 'parse modes disagree'
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
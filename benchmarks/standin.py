@@ -0,0 +1,81 @@
+"""
+Local stand-in for the Instructables web site used by the benchmarks.
+
+The recorded contest page in fixtures/ is served at /contest/ with every
+content.instructables.com link pointed back at the stand-in, and the recorded
+banners in fixtures/banners/ are served for the graphic links, so the scraper
+can be run end to end without touching the real site. Responses carry an
+ETag and honor If-None-Match the same way the real site does.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_HOST = 'https://content.instructables.com'
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real site
+    disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        body = self.server.files.get(path) or self.server.banners.get(path.rsplit('/', 1)[-1])
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_standin(port=0):
+    """Starts the stand-in on a background thread and returns (server, base_url)."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.daemon_threads = True
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    page = read_fixture('contest_page.html').replace(CONTENT_HOST.encode(), base_url.encode())
+    server.files = {'/contest/': page}
+    server.banners = {name: read_fixture(os.path.join('banners', name))
+                      for name in os.listdir(os.path.join(FIXTURES, 'banners'))}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def import_app(base_url):
+    """
+    Imports app.py scraping from the stand-in at base_url. The working directory is
+    moved to a scratch copy of static/ first so converted graphics don't land in
+    (or evict) the real image cache.
+    """
+    os.environ['CONTEST_URL'] = base_url + '/contest/'
+    scratch = tempfile.mkdtemp(prefix='contest-bench-')
+    os.makedirs(os.path.join(scratch, 'static', 'contestImg'))
+    os.chdir(scratch)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import app
+    return app
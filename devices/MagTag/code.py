@@ -42,12 +42,30 @@ Tutorials and references used as input to this project include:
 from adafruit_magtag.magtag import MagTag
 from secrets import secrets
 import alarm
+import microcontroller
 
 # Set up where we'll be fetching data from
-CONTEST_DATA_SOURCE = 'http://' + secrets['local_server'] + '/api/v1/contests'
+CONTEST_DATA_SOURCE = 'http://' + secrets['local_server'] + '/api/v1/contests?profile=magtag&format=tsv'
+DEVICE_ID = secrets.get('device_id') or ''.join('%02x' % b for b in microcontroller.cpu.uid)  # Counted in /api/v1/fleet
+CONTEST_DATA_SOURCE += '&device=' + DEVICE_ID
 CONTEST_DATA_LOCATION = []
 
 
+# Splits a tab separated response into rows as it arrives, so only one line at a time
+# is held in memory instead of the whole response and everything response.json() builds
+def tsv_rows(response, chunk_size=256):
+    pending = b''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        pending += chunk
+        line_end = pending.find(b'\n')
+        while line_end >= 0:
+            yield pending[:line_end].decode('utf-8').split('\t')
+            pending = pending[line_end + 1:]
+            line_end = pending.find(b'\n')
+    if pending:
+        yield pending.decode('utf-8').split('\t')
+
+
 class Contests:
     class Contest:
         def __init__(self, name='', deadline='', days_until=-1):
@@ -75,20 +93,25 @@ class Contests:
 
     def load_contests(self):
         try:
-            all_data = ''
+            loaded = False
             retry = 0
             self.contests.clear()
-            while all_data == '' and retry < 3:
+            while not loaded and retry < 3:
                 retry += 1
+                # A header row, then a row of tab separated values per contest
                 response = network.fetch(CONTEST_DATA_SOURCE)
-                all_data = response.json()
-                print(f"Retry #{retry}:\nResponse is {all_data}")
-            for entry in all_data:
-                contest = self.Contest(name=entry['name'],
-                                       deadline=entry['date'],
-                                       days_until=entry['days_until'])
-                self.contests.append(contest)
-            if retry >= 3:
+                rows = tsv_rows(response)
+                columns = next(rows)
+                name, date, days_until = (columns.index(column) for column in ('name', 'date', 'days_until'))
+                for row in rows:
+                    contest = self.Contest(name=row[name],
+                                           deadline=row[date],
+                                           days_until=int(row[days_until]))
+                    self.contests.append(contest)
+                response.close()
+                loaded = True
+                print(f"Retry #{retry}:\nResponse has {len(self.contests)} contests")
+            if not loaded:
                 print("Couldn't access web server")
         except RuntimeError as e:
             print("Some error occurred, retrying! -", e)
@@ -52,6 +52,7 @@ Tutorials and references used as input to this project include:
 """
 
 import time
+import microcontroller
 import board
 from digitalio import DigitalInOut, Direction, Pull
 import displayio
@@ -101,8 +102,26 @@ DATA_SOURCE += "&appid=" + secrets["openweather_token"]
 
 # --- Instructables contest data setup ---
 CONTEST_DATA_LOCATION = []
-CONTEST_DATA_SOURCE = ("http://" + secrets["local_server"] + "/api/v1/contests")
-CONTEST_SERVER_META = ("http://" + secrets["local_server"] + "/api/v1/meta")
+CONTEST_SNAPSHOT_SOURCE = (  # Contests and meta together
+        "http://" + secrets["local_server"] + "/api/v1/snapshot?profile=matrix&format=tsv"
+)
+DEVICE_ID = secrets.get("device_id") or "".join("%02x" % b for b in microcontroller.cpu.uid)  # Spreads refreshes
+CONTEST_SNAPSHOT_SOURCE += "&device=" + DEVICE_ID
+
+
+# Splits a tab separated response into rows as it arrives, so only one line at a time
+# is held in memory instead of the whole response and everything response.json() builds
+def tsv_rows(response, chunk_size=256):
+    pending = b''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        pending += chunk
+        line_end = pending.find(b'\n')
+        while line_end >= 0:
+            yield pending[:line_end].decode('utf-8').split('\t')
+            pending = pending[line_end + 1:]
+            line_end = pending.find(b'\n')
+    if pending:
+        yield pending.decode('utf-8').split('\t')
 
 # --- Drawing setup ---
 group = displayio.Group(max_size=4)  # Create a Group
@@ -178,29 +197,37 @@ class Contests:
             clock_label.x = 0
             event_label.text = 'Update'
             event_label.x = 0
-            all_data = ''
-            meta = ''
+            update_minutes = None
             retry = 0
             self.contests.clear()
-            while all_data == '' and retry < 3:
+            while update_minutes is None and retry < 3:
                 retry += 1
-                all_data = network.fetch_data(CONTEST_DATA_SOURCE, json_path=(CONTEST_DATA_LOCATION,))
-                meta = network.fetch_data(CONTEST_SERVER_META, json_path=(CONTEST_DATA_LOCATION,))
+                # The snapshot is a table of meta, a blank line and a table of contests, each a header
+                # row and rows of tab separated values. Contests are made row by row as they come in.
+                response = network.fetch(CONTEST_SNAPSHOT_SOURCE)
+                rows = tsv_rows(response)
+                meta_columns = next(rows)
+                meta = next(rows)
+                next(rows)  # blank line between the tables
+                columns = next(rows)
+                name, date, days_until = (columns.index(column) for column in ('name', 'date', 'days_until'))
+                for row in rows:
+                    contest = self.Contest(name=row[name],
+                                           deadline=row[date],
+                                           days_until=int(row[days_until]))
+                    self.contests.append(contest)
+                update_minutes = int(meta[meta_columns.index('refresh_seconds')]) / 60
+                response.close()
                 if DEBUG:
-                    print(f"Retry #{retry}:\nResponse is {all_data}")
+                    print(f"Retry #{retry}:\n{len(self.contests)} contests")
                     print(f'Meta is {meta}')
-            for entry in all_data:
-                contest = self.Contest(name=entry['name'],
-                                       deadline=entry['date'],
-                                       days_until=entry['days_until'])
-                self.contests.append(contest)
-            if retry >= 3:
+            if update_minutes is None:
                 contest = self.Contest(name='Web Server unreachable.',
                                        days_until=-1)
                 self.contests.append(contest)
                 self.update_minutes = 5  # Try again in 5 minutes
             else:
-                self.update_minutes = meta['next_update_minutes'] + 1  # update 1 minutes after web server
+                self.update_minutes = update_minutes  # The server staggers devices over a few minutes after its update
         except RuntimeError as e:
             print("Some error occurred, retrying! -", e)
             contest = self.Contest(name='Web Server unreachable.',
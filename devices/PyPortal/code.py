@@ -45,12 +45,31 @@ from adafruit_pyportal import PyPortal
 from secrets import secrets
 import os, board, sdcardio, storage
 import gc
+import microcontroller
 
 DEBUG = False
 
 # Set up where we'll be fetching data from
-CONTEST_DATA_SOURCE = 'http://' + secrets['local_server'] + '/api/v1/contests'
-CONTEST_SERVER_META = ("http://" + secrets["local_server"] + "/api/v1/meta")
+DEVICE_ID = secrets.get('device_id') or ''.join('%02x' % b for b in microcontroller.cpu.uid)  # Spreads refreshes
+CONTEST_SNAPSHOT_SOURCE = (  # Contests and meta together
+        'http://' + secrets['local_server'] + '/api/v1/snapshot?profile=pyportal&format=tsv'
+)
+CONTEST_SNAPSHOT_SOURCE += '&device=' + DEVICE_ID
+
+
+# Splits a tab separated response into rows as it arrives, so only one line at a time
+# is held in memory instead of the whole response and everything response.json() builds
+def tsv_rows(response, chunk_size=256):
+    pending = b''
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        pending += chunk
+        line_end = pending.find(b'\n')
+        while line_end >= 0:
+            yield pending[:line_end].decode('utf-8').split('\t')
+            pending = pending[line_end + 1:]
+            line_end = pending.find(b'\n')
+    if pending:
+        yield pending.decode('utf-8').split('\t')
 
 
 class Contests:
@@ -81,62 +100,81 @@ class Contests:
         def get_contest_graphic(self):
             if self.graphic_file:
                 return self.graphic_file
-            file_parts = self.graphic.split('/')
-            filename = file_parts[-1]
+            # The server puts a hash of the graphic in its URI, so a file already on the SD card
+            # is always current and a new graphic gets a new file name.
+            file_parts = self.graphic.split('/')  # .../image/<contest>.<hash>/<variant>-<mode>
+            filename = f'{file_parts[-2]}-{file_parts[-1]}.bmp'
             try:
                 t = os.stat(f'/sd/{filename}')  # testing for existence
             except OSError as e:  # file doesn't exist, get from URI
                 retry = 0
                 while retry < 3:
                     try:
-                        network.wget(f'http://{secrets["local_server"]}/{self.graphic}',
-                                     f'/sd/{filename}',
-                                     chunk_size=512)
-                        self.graphic_file = f'/sd/{filename}'
+                        download_resuming(f'http://{secrets["local_server"]}/{self.graphic}',
+                                          f'/sd/{filename}')
                         break
                     except Exception as e:
                         print(f'Exception {e}, retrying ({retry}')
                         retry += 1
                 if retry >= 3:
                     return None
-            return f'/sd/{filename}'
+            self.graphic_file = f'/sd/{filename}'
+            return self.graphic_file
 
     def __init__(self):
         self.index = -1
         self.contests = []
         self.update_minutes = None
         self.contest_refresh = None
+        self.etag = None
 
     def load_contests(self):
         try:
-            all_data = ''
-            meta = ''
+            loaded = False
             retry = 0
-            self.contests.clear()
-            while all_data == '' and retry < 3:
+            while not loaded and retry < 3:
                 retry += 1
-                response = network.fetch(CONTEST_DATA_SOURCE)
-                all_data = response.json()
-                response = network.fetch(CONTEST_SERVER_META)
-                meta = response.json()
+                # Only download and parse the contests if they changed since the last load
+                headers = {'If-None-Match': self.etag} if self.etag and self.contests else None
+                response = network.fetch(CONTEST_SNAPSHOT_SOURCE, headers=headers)
+                if response.status_code == 304:
+                    # Web server hasn't updated yet, check again when it says this device's turn is
+                    self.update_minutes = max_age(response, 5 * 60) / 60
+                    loaded = True
+                else:
+                    self.etag = response.headers.get('etag')
+                    self.read_snapshot(response)
+                    loaded = True
+                response.close()
                 if DEBUG:
-                    print(f"Retry #{retry}:\nResponse is {all_data}")
-                    print(f'Meta is {meta}')
-            for entry in all_data:
-                contest = self.Contest(name=entry['name'],
-                                       deadline=entry['date'],
-                                       days_until=int(entry['days_until']),
-                                       graphic=entry['contest_graphic_uri']
-                                       )
-                self.contests.append(contest)
-            self.update_minutes = meta['next_update_minutes'] + 1  # update 1 minutes after web server
+                    print(f'Retry #{retry}: {len(self.contests)} contests, update in {self.update_minutes} minutes')
             self.contest_refresh = time.monotonic()
-            all_data = None
             gc.collect()
         except RuntimeError as e:
             print("Some error occurred, retrying! -", e)
             return None
 
+    # The snapshot is a table of meta, a blank line and a table of contests, each a header row and
+    # rows of tab separated values. Contests are made row by row as the response comes in.
+    def read_snapshot(self, response):
+        rows = tsv_rows(response)
+        meta_columns = next(rows)
+        meta = next(rows)
+        # The server staggers devices over a few minutes after its next update
+        update_minutes = int(meta[meta_columns.index('refresh_seconds')]) / 60
+        next(rows)  # blank line between the tables
+        columns = next(rows)
+        name, date, days_until, graphic = (columns.index(column)
+                                           for column in ('name', 'date', 'days_until', 'contest_graphic_uri'))
+        self.contests.clear()
+        for row in rows:
+            self.contests.append(self.Contest(name=row[name],
+                                              deadline=row[date],
+                                              days_until=int(row[days_until]),
+                                              graphic=row[graphic]
+                                              ))
+        self.update_minutes = update_minutes
+
     def get_next_contest_string_and_graphic(self):
         self.index += 1
         if self.index >= len(self.contests):
@@ -150,6 +188,49 @@ class Contests:
         return self.contests[self.index].get_contest_graphic_uri()
 
 
+# Seconds in the max-age of the response's Cache-Control header, or default if it has none
+def max_age(response, default):
+    for directive in response.headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'max-age':
+            return int(value)
+    return default
+
+
+# Downloads url to filename through filename.part, which is kept when the download is
+# cut off so the next try only asks the server for the rest of the file. The ETag the
+# part came with is kept in filename.etag and sent as If-Range, so if the graphic has
+# changed since, the server sends all of it again rather than the rest of a different one.
+def download_resuming(url, filename, chunk_size=512):
+    part_filename = filename + '.part'
+    etag_filename = filename + '.etag'
+    try:
+        offset = os.stat(part_filename)[6]
+        with open(etag_filename) as f:
+            etag = f.read()
+    except OSError:
+        offset, etag = 0, ''
+    headers = {'Range': f'bytes={offset}-', 'If-Range': etag} if offset and etag else None
+    response = network.fetch(url, headers=headers)
+    try:
+        if response.status_code == 416:  # The part file holds all of it already
+            os.rename(part_filename, filename)
+            os.remove(etag_filename)
+            return
+        if response.status_code not in (200, 206):
+            raise RuntimeError(f'HTTP {response.status_code} fetching {url}')
+        if response.status_code == 200:  # The whole file, from the start
+            with open(etag_filename, 'w') as f:
+                f.write(response.headers.get('etag', ''))
+        with open(part_filename, 'ab' if response.status_code == 206 else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    finally:
+        response.close()
+    os.rename(part_filename, filename)
+    os.remove(etag_filename)
+
+
 # Convenience function to purge cache of all graphic files on SD
 def purge_cache():
     # sd = sdcardio.SDCard(board.SPI(), board.SD_CS)
@@ -158,7 +239,7 @@ def purge_cache():
     files = os.listdir('/sd')
     file_count = 0
     for file in files:
-        if file[-4:] == '.bmp':
+        if file[-4:] == '.bmp' or file[-9:] == '.bmp.part' or file[-9:] == '.bmp.etag':
             os.remove(f'/sd/{file}')
             file_count += 1
     print(f'Cache cleanup removed {file_count}')
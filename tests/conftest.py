@@ -0,0 +1,39 @@
+"""
+The tests import app.py once, scraping the local stand-in for the Instructables
+web site in benchmarks/standin.py, from a scratch directory of its own.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from standin import start_standin, import_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def standin():
+    """The stand-in server and its base URL."""
+    server, base_url = start_standin()
+    yield server, base_url
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def app(standin):
+    """The app module, with the contests on the stand-in's page published."""
+    return import_app(standin[1])
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def entries(app):
+    """The (Contest, deadline, source hash) entries the current snapshot was made from."""
+    deadlines = {index: deadline for deadline, index in app.snapshot.deadlines}
+    return [(contest, deadlines[index], app.snapshot.graphics[app.contest_slug(contest.name)])
+            for index, contest in enumerate(app.snapshot.contests)]
@@ -0,0 +1,61 @@
+def test_contests_revalidate(client):
+    first = client.get('/api/v1/contests')
+    assert first.status_code == 200
+    assert client.get('/api/v1/contests', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    gzipped = client.get('/api/v1/contests', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] != first.headers['ETag']
+    assert client.get('/api/v1/contests', headers={'Accept-Encoding': 'gzip',
+                                                   'If-None-Match': gzipped.headers['ETag']}).status_code == 304
+    # Any encoding of the same contests is still current
+    assert client.get('/api/v1/contests', headers={'If-None-Match': gzipped.headers['ETag']}).status_code == 304
+    assert client.get('/api/v1/contests', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_snapshot(app, client):
+    body = client.get('/api/v1/snapshot').get_json()
+    assert body['contests'] == client.get('/api/v1/contests').get_json()
+    assert body['meta']['version'] == app.snapshot.version
+    assert body['meta']['contest_count'] == len(body['contests'])
+
+
+def test_snapshot_revalidates(client):
+    first = client.get('/api/v1/snapshot')
+    assert first.headers['ETag'].startswith('W/')
+    assert client.get('/api/v1/snapshot', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    # Other fields are another payload, and so another ETag
+    assert client.get('/api/v1/snapshot?profile=pyportal',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def tsv_rows(text):
+    return [line.split('\t') for line in text.split('\n')[:-1]]
+
+
+def test_contests_as_tsv(app, client):
+    contests = client.get('/api/v1/contests').get_json()
+    response = client.get('/api/v1/contests?format=tsv')
+    assert response.mimetype == 'text/tab-separated-values'
+    rows = tsv_rows(response.get_data(as_text=True))
+    assert rows[0] == list(app.CONTEST_FIELDS)
+    assert rows[1:] == [[str(contest[name]) for name in app.CONTEST_FIELDS] for contest in contests]
+
+    accepted = client.get('/api/v1/contests?profile=pyportal', headers={'Accept': 'text/tab-separated-values'})
+    assert tsv_rows(accepted.get_data(as_text=True))[0] == list(app.PROFILES['pyportal'])
+    assert client.get('/api/v1/contests?format=xml').status_code == 400
+
+
+def test_snapshot_as_tsv(app, client):
+    text = client.get('/api/v1/snapshot?format=tsv&profile=pyportal').get_data(as_text=True)
+    meta, contests = text.split('\n\n')
+    meta = dict(zip(*tsv_rows(meta + '\n')))
+    assert int(meta['version']) == app.snapshot.version
+    assert int(meta['refresh_seconds']) > 0
+    contests = tsv_rows(contests)
+    assert contests[0] == list(app.PROFILES['pyportal'])
+    assert len(contests) - 1 == int(meta['contest_count'])
+
+
+def test_tsv_values_stay_on_their_line(app):
+    assert app.tsv_table(['name'], [['Tabs\tand\r\nbreaks']]) == b'name\nTabs and  breaks\n'
@@ -0,0 +1,47 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+
+def test_delta_without_changes(app, client):
+    body = client.get(f'/api/v1/contests?since={app.snapshot.version}').get_json()
+    assert (body['added'], body['changed'], body['removed'], body['full']) == ([], [], [], False)
+    assert body['names'] == [contest['name'] for contest in client.get('/api/v1/contests').get_json()]
+
+
+def test_delta_of_a_new_snapshot(app, client, entries, monkeypatch):
+    old = app.snapshot
+    (removed, _, _), (changed, deadline, source_hash) = entries[0], entries[1]
+    added = app.Contest('Brand New Contest', 'December 31', 0, 'https://example.com/new',
+                        app.contest_graphic_path('Brand New Contest', None), '0', 'BrandNewContest')
+    entries = [(replace(changed, entry_count='999'), deadline, source_hash)] + entries[2:] + \
+              [(added, datetime.now() + timedelta(days=30), None)]
+    monkeypatch.setattr(app, 'snapshot', app.make_snapshot(old.version + 1, entries, previous=old))
+
+    body = client.get(f'/api/v1/contests?since={old.version}').get_json()
+    assert [contest['name'] for contest in body['added']] == [added.name]
+    assert [(contest['name'], contest['entry_count']) for contest in body['changed']] == [(changed.name, '999')]
+    assert body['removed'] == [removed.name]
+    assert body['version'] == old.version + 1
+    live = client.get('/api/v1/contests').get_json()
+    assert body['names'] == [contest['name'] for contest in live]
+    assert body['days_until'] == [contest['days_until'] for contest in live]
+    assert body['added'][0] == live[-1]  # Counted down the same as the rest
+
+    # A change to a field the request didn't select doesn't show up
+    body = client.get(f'/api/v1/contests?since={old.version}&fields=name,date').get_json()
+    assert body['changed'] == []
+    assert body['added'] == [{'name': added.name, 'date': added.date}]
+
+
+def test_delta_from_an_unknown_version_is_full(app, client):
+    response = client.get('/api/v1/contests?since=-1&profile=pyportal')
+    assert response.mimetype == 'application/json'
+    body = response.get_json()
+    assert body['full'] is True
+    assert body['version'] == app.snapshot.version
+    assert body['contests'] == client.get('/api/v1/contests?profile=pyportal').get_json()
+
+
+def test_delta_arguments(client):
+    assert client.get('/api/v1/contests?since=abc').status_code == 400
+    assert client.get('/api/v1/contests?since=0&format=tsv').status_code == 400
@@ -0,0 +1,46 @@
+import socket
+
+import pytest
+import requests
+
+
+def test_fetch_revalidates(app, standin):
+    server, base_url = standin
+    first = app.fetch(base_url + '/contest/')
+    assert first.status_code == 200
+    again = app.fetch(base_url + '/contest/', etag=first.headers['ETag'])
+    assert again.status_code == 304
+    assert again.content == b''
+
+
+def test_unchanged_page_is_not_parsed(app, monkeypatch):
+    def parse_contest_page(*args, **kwargs):
+        raise AssertionError('parsed a page that had not changed')
+    monkeypatch.setattr(app, 'parse_contest_page', parse_contest_page)
+    hits = dict(app.cache_total.values)
+    contests = app.update_contests()
+    assert [contest for contest, deadline, source_hash in contests] == list(app.snapshot.contests)
+    assert app.cache_total.values[('page', 'hit')] == hits.get(('page', 'hit'), 0) + 1
+    assert app.cache_total.values[('image_source', 'hit')] == \
+        hits.get(('image_source', 'hit'), 0) + len(contests)
+
+
+def test_changed_page_is_parsed(app, standin, monkeypatch):
+    server, base_url = standin
+    parsed = []
+    parse_contest_page = app.parse_contest_page
+    monkeypatch.setattr(app, 'parse_contest_page', lambda *args, **kwargs:
+                        parsed.append(True) or parse_contest_page(*args, **kwargs))
+    monkeypatch.setitem(server.files, '/contest/', server.files['/contest/'] + b'\n<!-- changed -->\n')
+    contests = app.update_contests()
+    assert parsed == [True]
+    assert [contest for contest, deadline, source_hash in contests] == list(app.snapshot.contests)
+
+
+def test_fetch_times_out(app, monkeypatch):
+    monkeypatch.setattr(app, 'FETCH_TIMEOUT', (1, 0.2))
+    with socket.socket() as silent:  # Connections are queued but never answered
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(1)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            app.fetch(f'http://127.0.0.1:{silent.getsockname()[1]}/contest/')
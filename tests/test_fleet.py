@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def fleet(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'HISTORY_FILE', str(tmp_path / 'history.sqlite3'))
+    monkeypatch.setattr(app, 'fleet', app.Fleet())
+    return app.fleet
+
+
+def test_devices_are_staggered(app, client):
+    refresh_seconds = [client.get(f'/api/v1/meta?device=device-{number}').get_json()['refresh_seconds']
+                       for number in range(20)]
+    assert len(set(refresh_seconds)) > 10
+    assert max(refresh_seconds) - min(refresh_seconds) <= app.REFRESH_WINDOW
+    assert app.device_jitter('device-1') == app.device_jitter('device-1')
+
+
+def test_snapshot_304_keeps_the_refresh_time(client):
+    first = client.get('/api/v1/snapshot?format=tsv&device=test')
+    again = client.get('/api/v1/snapshot?format=tsv&device=test', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.headers['Cache-Control'] == first.headers['Cache-Control']
+    assert 'max-age=' in again.headers['Cache-Control']
+
+
+def test_fleet_report(app, client, fleet):
+    for device in ('pyportal-1', 'pyportal-2'):
+        client.get(f'/api/v1/snapshot?format=tsv&profile=pyportal&device={device}')
+    client.get('/api/v1/contests?device=magtag-1')
+    report = client.get('/api/v1/fleet').get_json()
+    assert list(report['devices']) == ['magtag-1', 'pyportal-1', 'pyportal-2']
+    assert report['devices']['magtag-1']['next_refresh'] is None
+    assert report['devices']['pyportal-1']['route'] == '/api/v1/snapshot'
+    assert report['check_ins_last_hour'] == 3
+    assert sum(count for minute, count in report['refreshes_by_minute']) == 2
+    assert fleet.count() == 3
+
+
+def test_fleet_is_shared_by_workers(app, client, fleet):
+    client.get('/api/v1/snapshot?device=pyportal-1')
+    other_worker = app.Fleet()
+    other_worker.check_in('pyportal-2', '/api/v1/snapshot', None)
+    assert list(fleet.report()['devices']) == list(other_worker.report()['devices']) == ['pyportal-1', 'pyportal-2']
+
+
+def test_fleet_forgets_devices(app, fleet, monkeypatch):
+    monkeypatch.setattr(app, 'DEVICE_LIMIT', 3)
+    monkeypatch.setattr(app, 'SHARED_POLL_SECONDS', -1)  # Prune on every check-in
+    with fleet.connection():
+        fleet.connection().execute('INSERT INTO check_ins VALUES (?, ?, ?, NULL)',
+                                   ('gone', time.time() - app.DEVICE_FORGET - 1, '/api/v1/contests'))
+    for number in range(5):
+        fleet.check_in(f'device-{number}', '/api/v1/contests', None)
+    assert fleet.connection().execute('SELECT device FROM check_ins ORDER BY seen').fetchall() == \
+        [('device-2',), ('device-3',), ('device-4',)]
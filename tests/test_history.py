@@ -0,0 +1,50 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def history(app, entries, monkeypatch, tmp_path):
+    """A history of the first contest with its entry count going up by one every hour for ten hours."""
+    monkeypatch.setattr(app, 'HISTORY_FILE', str(tmp_path / 'history.sqlite3'))
+    contest, deadline, source_hash = entries[0]
+    start = datetime(2021, 2, 1)
+    for hour in range(10):
+        app.record_history(app.make_snapshot(hour + 1, [(replace(contest, entry_count=f'{hour + 100} Entries'),
+                                                         deadline, source_hash)], start + timedelta(hours=hour)))
+    return contest.contest_id, int(start.timestamp())
+
+
+def test_contests_name_their_history(app, client):
+    contest = client.get('/api/v1/contests').get_json()[0]
+    assert contest['contest_id'] == app.contest_slug(contest['name'])
+    body = client.get(f'/api/v1/contests/{contest["contest_id"]}/history').get_json()
+    assert body['contest'] == contest['contest_id']
+    assert body['series'][-1][1] == app.parse_entry_count(contest['entry_count'])
+
+
+def test_history(client, history):
+    contest_id, start = history
+    body = client.get(f'/api/v1/contests/{contest_id}/history').get_json()
+    assert body['series'] == [[start + hour * 3600, hour + 100] for hour in range(10)]
+
+    body = client.get(f'/api/v1/contests/{contest_id}/history?points=5').get_json()
+    assert len(body['series']) == 5
+    assert body['series'][-1] == [start + 9 * 3600, 109]  # The last sample of each span
+
+    body = client.get(f'/api/v1/contests/{contest_id}/history?start={start + 3600}&end={start + 3 * 3600}').get_json()
+    assert [entry_count for ts, entry_count in body['series']] == [101, 102, 103]
+
+
+def test_history_arguments(client, history):
+    contest_id, start = history
+    assert client.get('/api/v1/contests/NoSuchContest/history').status_code == 404
+    for query in ('start=abc', 'end=1.5', 'points=many'):
+        assert client.get(f'/api/v1/contests/{contest_id}/history?{query}').status_code == 400, query
+    assert client.get(f'/api/v1/contests/{contest_id}/history?start={start + 86400}').status_code == 404
+
+
+def test_parse_entry_count(app):
+    assert app.parse_entry_count('1,234 Entries') == 1234
+    assert app.parse_entry_count('') is None
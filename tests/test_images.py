@@ -0,0 +1,140 @@
+import io
+import os
+from dataclasses import replace
+
+import pytest
+from PIL import Image
+
+from standin import read_fixture, FIXTURES
+
+BANNERS = sorted(os.listdir(os.path.join(FIXTURES, 'banners')))
+
+
+@pytest.mark.parametrize('mode', ['exact', 'fast'])
+def test_renditions(app, mode):
+    rendered = app.render_variants(read_fixture(os.path.join('banners', BANNERS[0])), mode=mode)
+    assert set(rendered) == set(app.RENDITIONS)
+    for variant, im in rendered.items():
+        rendition = app.RENDITIONS[variant]
+        assert im.size == rendition.size
+        assert im.mode == 'P'
+        assert len(im.getcolors(256)) <= rendition.colors
+        if rendition.grayscale:
+            assert all(red == green == blue for count, (red, green, blue) in im.convert('RGB').getcolors(256))
+
+
+def test_profiles_select_their_variant(client):
+    pyportal = client.get('/api/v1/contests?profile=pyportal').get_json()
+    assert all(contest['contest_graphic_uri'].endswith('/pyportal-exact') for contest in pyportal)
+    for profile in ('magtag', 'matrix'):  # Their devices draw no graphic
+        assert set(client.get(f'/api/v1/contests?profile={profile}').get_json()[0]) == {'name', 'date', 'days_until'}
+
+
+def test_variant_argument(client):
+    for query in ('variant=matrix', 'fields=name,contest_graphic_uri&variant=matrix',
+                  'profile=pyportal&variant=matrix'):
+        contests = client.get('/api/v1/contests?' + query).get_json()
+        assert all(contest['contest_graphic_uri'].endswith('/matrix-exact') for contest in contests), query
+    assert client.get('/api/v1/contests?variant=pyportal').get_data() == client.get('/api/v1/contests').get_data()
+    assert client.get('/api/v1/contests?variant=poster').status_code == 400
+
+
+@pytest.mark.parametrize('variant', ['pyportal', 'matrix', 'magtag'])
+def test_graphic_variants(app, client, variant):
+    uri = client.get(f'/api/v1/contests?fields=contest_graphic_uri&variant={variant}').get_json()[0]
+    response = client.get('/' + uri['contest_graphic_uri'])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/bmp'
+    assert Image.open(io.BytesIO(response.data)).size == app.RENDITIONS[variant].size
+
+
+def test_slugs_are_one_path_segment(app):
+    assert app.contest_slug('Audio/Visual Contest') == 'AudioVisualContest'
+    assert app.contest_slug('Fix It? #3 & Café 50%') == 'FixIt3Caf50'
+    assert app.contest_slug('First-Time_Author') == 'First-Time_Author'
+
+
+def test_graphic_of_a_name_with_a_slash(app, client, entries, monkeypatch):
+    contest, deadline, source_hash = entries[0]
+    name = 'Audio/Visual Contest'
+    renamed = replace(contest, name=name, contest_graphic_uri=app.contest_graphic_path(name, source_hash),
+                      contest_id=app.contest_slug(name))
+    monkeypatch.setattr(app, 'snapshot', app.make_snapshot(app.snapshot.version + 1,
+                                                           [(renamed, deadline, source_hash)] + entries[1:],
+                                                           previous=app.snapshot))
+    uri = client.get('/api/v1/contests').get_json()[0]['contest_graphic_uri']
+    assert uri.startswith('api/v1/image/AudioVisualContest.')
+    assert client.get('/' + uri).status_code == 200
+
+
+def test_lru_evicts_the_least_recently_used(app):
+    lru = app.ImageLRU(30)
+    for key in 'abc':
+        lru.put(key, b'x' * 10)
+    assert lru.get('a') == b'x' * 10  # Now the most recently used
+    lru.put('d', b'x' * 10)
+    assert lru.get('b') is None
+    assert [lru.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert lru.size == 30
+    lru.put('e', b'x' * 100)  # Kept even when bigger than the whole LRU
+    assert list(lru.images) == ['e']
+    assert lru.size == 100
+
+
+def test_rendered_graphics_are_kept(app, entries, monkeypatch):
+    monkeypatch.setattr(app, 'image_lru', app.ImageLRU(app.IMAGE_LRU_BYTES))
+    source_hash = entries[0][2]
+    image = app.rendered_image(source_hash, 'matrix')
+    renders = []
+    render_variants = app.render_variants
+    monkeypatch.setattr(app, 'render_variants', lambda *args: renders.append(args) or render_variants(*args))
+    assert app.rendered_image(source_hash, 'matrix') is image
+    assert app.rendered_image(source_hash, 'matrix', 'exact') is image
+    assert renders == []
+    assert app.rendered_image(source_hash, 'matrix', 'fast') is not image  # Another mode is another graphic
+    assert len(renders) == 1
+
+
+def test_fixed_palette(app):
+    palette = app.fixed_palette(256).getpalette()[:256 * 3]
+    colors = set(zip(palette[0::3], palette[1::3], palette[2::3]))
+    assert len(colors) == 256
+    assert [len(set(channel)) for channel in zip(*colors)] == [8, 8, 4]
+
+
+def test_graphic_ranges(client):
+    uri = '/' + client.get('/api/v1/contests').get_json()[0]['contest_graphic_uri']
+    full = client.get(uri)
+    assert full.status_code == 200
+    assert full.headers['Accept-Ranges'] == 'bytes'
+    assert 'immutable' in full.headers['Cache-Control']
+    image = full.data
+
+    part = client.get(uri, headers={'Range': 'bytes=100-'})
+    assert part.status_code == 206
+    assert part.data == image[100:]
+    assert part.headers['Content-Range'] == f'bytes 100-{len(image) - 1}/{len(image)}'
+
+    resumed = client.get(uri, headers={'Range': 'bytes=100-', 'If-Range': full.headers['ETag']})
+    assert resumed.status_code == 206
+    assert resumed.data == image[100:]
+
+    # The graphic changed since the part was downloaded, so all of it comes back
+    restarted = client.get(uri, headers={'Range': 'bytes=100-', 'If-Range': '"another graphic"'})
+    assert restarted.status_code == 200
+    assert restarted.data == image
+
+    assert client.get(uri, headers={'Range': f'bytes={len(image)}-'}).status_code == 416
+    assert client.get(uri, headers={'If-None-Match': full.headers['ETag']}).status_code == 304
+
+
+def test_graphic_modes(client):
+    uri = '/' + client.get('/api/v1/contests').get_json()[0]['contest_graphic_uri']
+    assert uri.endswith('/pyportal-exact')
+    assert client.get(uri[:-len('exact')] + 'fast').status_code == 200
+    assert client.get(uri[:-len('exact')] + 'lossy').status_code == 404
+    unversioned = client.get(uri.rpartition('-')[0])
+    assert unversioned.status_code == 200
+    assert 'immutable' not in unversioned.headers['Cache-Control']
+    slug, _, version = uri.split('/')[-2].rpartition('.')
+    assert client.get(uri.replace(version, '0' * len(version))).status_code == 404
@@ -0,0 +1,21 @@
+def test_index_revalidates(client):
+    first = client.get('/')
+    assert first.status_code == 200
+    assert first.mimetype == 'text/html'
+    last_modified = first.headers['Last-Modified']
+    assert client.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert client.get('/', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/', headers={'If-Modified-Since': 'Mon, 01 Feb 2021 00:00:00 GMT'}).status_code == 200
+    # If-None-Match decides when both are sent
+    assert client.get('/', headers={'If-None-Match': '"stale"', 'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_index_is_rendered_once_per_view(app, client):
+    client.get('/')
+    hits = app.cache_total.values.get(('index', 'hit'), 0)
+    misses = app.cache_total.values.get(('index', 'miss'), 0)
+    body = client.get('/').get_data()
+    assert app.cache_total.values[('index', 'hit')] == hits + 1
+    assert app.cache_total.values.get(('index', 'miss'), 0) == misses
+    for contest in app.contests_view(app.snapshot).contests:
+        assert contest.contest_graphic_uri.encode() in body
@@ -0,0 +1,28 @@
+import pytest
+
+
+def metric_value(text, line_start):
+    return float(next(line for line in text.splitlines() if line.startswith(line_start + ' ')).rsplit(' ', 1)[1])
+
+
+def test_metrics(app, client):
+    client.get('/api/v1/contests')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert metric_value(text, 'contest_snapshot_version') == app.snapshot.version
+    assert metric_value(text, 'contest_http_requests_total{route="/api/v1/contests",status="200"}') >= 1
+    for stage in ('total', 'page_fetch', 'parse'):
+        assert metric_value(text, f'contest_scrape_stage_seconds_count{{stage="{stage}"}}') >= 1
+    assert '# TYPE contest_http_request_duration_seconds histogram' in text
+
+
+def test_histogram_buckets(app):
+    histogram = app.Histogram('test_seconds', 'Test', ('stage',))
+    for seconds in (0.001, 0.02, 0.02, 100):
+        histogram.observe(seconds, 'a')
+    text = '\n'.join(histogram.render())
+    assert metric_value(text, 'test_seconds_bucket{stage="a",le="0.005"}') == 1
+    assert metric_value(text, 'test_seconds_bucket{stage="a",le="0.025"}') == 3
+    assert metric_value(text, 'test_seconds_bucket{stage="a",le="60"}') == 3
+    assert metric_value(text, 'test_seconds_bucket{stage="a",le="+Inf"}') == 4
+    assert metric_value(text, 'test_seconds_count{stage="a"}') == 4
+    assert metric_value(text, 'test_seconds_sum{stage="a"}') == pytest.approx(100.041)
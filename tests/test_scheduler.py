@@ -0,0 +1,61 @@
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def scheduler(app, monkeypatch):
+    monkeypatch.setattr(app, 'UPDATE_JITTER', 0)
+    return app.RefreshScheduler()
+
+
+def test_scheduler_backs_off(app, scheduler):
+    quiet = SimpleNamespace(contests=(), deadlines=())
+    minutes = []
+    for _ in range(5):
+        scheduler.schedule(quiet, quiet)
+        minutes.append(scheduler.interval_minutes(quiet))
+    assert minutes == [app.UPDATE_EVERY * 2, app.UPDATE_EVERY * 4, app.UPDATE_EVERY * 8,
+                       app.MAX_UPDATE_EVERY, app.MAX_UPDATE_EVERY]
+
+    changed = SimpleNamespace(contests=app.snapshot.contests, deadlines=())
+    scheduler.schedule(quiet, changed)
+    assert scheduler.interval_minutes(changed) == app.UPDATE_EVERY
+
+
+def test_scheduler_closes_in_on_deadlines(app, scheduler):
+    soon = SimpleNamespace(deadlines=((datetime.now() + timedelta(minutes=60), 0),))
+    assert scheduler.interval_minutes(soon) == pytest.approx(30, abs=0.1)
+    closing = SimpleNamespace(deadlines=((datetime.now() + timedelta(minutes=5), 0),))
+    assert scheduler.interval_minutes(closing) == app.MIN_UPDATE_EVERY
+    ended = SimpleNamespace(deadlines=((datetime.now() - timedelta(minutes=5), 0),))
+    assert scheduler.interval_minutes(ended) == app.UPDATE_EVERY
+
+
+def test_scheduler_jitter(app, scheduler, monkeypatch):
+    monkeypatch.setattr(app, 'UPDATE_JITTER', 0.1)
+    quiet = SimpleNamespace(deadlines=())
+    minutes = [scheduler.interval_minutes(quiet) for _ in range(100)]
+    assert all(app.UPDATE_EVERY * 0.9 <= interval <= app.UPDATE_EVERY * 1.1 for interval in minutes)
+    assert len(set(minutes)) > 1
+
+
+def test_scheduler_trigger(scheduler):
+    scheduler.next_run = datetime.now() + timedelta(hours=1)
+    waiter = threading.Thread(target=scheduler.wait)
+    waiter.start()
+    scheduler.trigger()
+    waiter.join(5)
+    assert not waiter.is_alive()
+
+
+def test_refresh_needs_the_token(app, client, monkeypatch):
+    monkeypatch.setattr(app, 'REFRESH_TOKEN', 'secret')
+    assert client.post('/api/v1/refresh').status_code == 403
+    assert client.post('/api/v1/refresh', headers={'Authorization': 'secret'}).status_code == 403
+    assert client.post('/api/v1/refresh', headers={'Authorization': 'Basic secret'}).status_code == 403
+    assert client.post('/api/v1/refresh', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    monkeypatch.setattr(app, 'REFRESH_TOKEN', None)
+    assert client.post('/api/v1/refresh', headers={'Authorization': 'Bearer '}).status_code == 403
@@ -0,0 +1,44 @@
+from standin import read_fixture
+
+PAGE = read_fixture('contest_page.html')
+
+
+def test_unchanged_scrape_publishes_nothing(app, client, standin, monkeypatch):
+    server, base_url = standin
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)  # Put back after the test
+    current = app.snapshot
+    etag = client.get('/api/v1/snapshot').headers['ETag']
+    app.update_contests(app.publish_snapshot)  # The page answers 304
+    monkeypatch.setitem(server.files, '/contest/', server.files['/contest/'] + b'\n<!-- changed -->\n')
+    app.update_contests(app.publish_snapshot)  # The page is parsed again, to the same contests
+    assert app.snapshot is current
+    assert client.get('/api/v1/snapshot', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_changed_scrape_is_published(app, entries, monkeypatch):
+    monkeypatch.setattr(app, 'snapshot', app.snapshot)
+    current = app.snapshot
+    assert app.publish_snapshot(entries[1:]).version == current.version + 1
+
+
+def test_broken_banner_keeps_the_last_one(app):
+    banners = app.parse_contest_page(PAGE)
+    broken = PAGE.replace(b'data-deadline="2031-01-01T23:59:00"', b'data-deadline="soon"', 1)
+    assert app.parse_contest_page(broken, previous=banners) == banners
+    assert app.parse_contest_page(broken) == banners[1:]  # Nothing to fall back on
+
+
+def test_failed_download_keeps_the_last_banner(app, standin, monkeypatch):
+    server, base_url = standin
+    contests = app.update_contests()
+    banner_uris = {entry['sha256']: uri for uri, entry in app.image_cache.items()}
+    not_found, timed_out = (banner_uris[source_hash] for contest, deadline, source_hash in contests[:2])
+    monkeypatch.delitem(server.banners, not_found.split('?')[0].rsplit('/', 1)[-1])
+    save_contest_source = app.save_contest_source
+
+    def timing_out(contest_graphic_uri):
+        if contest_graphic_uri == timed_out:
+            raise app.requests.exceptions.ReadTimeout()
+        return save_contest_source(contest_graphic_uri)
+    monkeypatch.setattr(app, 'save_contest_source', timing_out)
+    assert app.update_contests() == contests
@@ -0,0 +1,30 @@
+import threading
+
+
+def test_wait_arguments(client):
+    assert client.get('/api/v1/wait?version=abc').status_code == 400
+    assert client.get('/api/v1/wait?timeout=soon').status_code == 400
+    assert client.get('/api/v1/wait?timeout=nan').status_code == 400
+
+
+def test_wait_times_out(app, client):
+    assert client.get(f'/api/v1/wait?version={app.snapshot.version}&timeout=0.1').status_code == 204
+
+
+def test_wait_for_an_older_version(app, client):
+    response = client.get(f'/api/v1/wait?version={app.snapshot.version - 1}&timeout=5')
+    assert response.status_code == 200
+    assert response.get_json()['meta']['version'] == app.snapshot.version
+
+
+def test_wait_for_a_publish(app, client, entries, monkeypatch):
+    current = app.snapshot
+    monkeypatch.setattr(app, 'snapshot', current)  # Put back after the test
+    waiting = []
+    waiter = threading.Thread(target=lambda: waiting.append(
+        client.get(f'/api/v1/wait?version={current.version}&timeout=5&format=tsv')))
+    waiter.start()
+    app.publish(app.make_snapshot(current.version + 1, entries, previous=current))
+    waiter.join(5)
+    assert waiting[0].status_code == 200
+    assert waiting[0].mimetype == 'text/tab-separated-values'
@@ -0,0 +1,86 @@
+import os
+import signal
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def snapshot_file(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'SNAPSHOT_FILE', str(tmp_path / 'snapshot.pickle'))
+    return app.SNAPSHOT_FILE
+
+
+def test_snapshot_round_trip(app, snapshot_file):
+    next_run = datetime.now() + timedelta(minutes=30)
+    app.save_snapshot(app.snapshot, next_run)
+    saved, saved_next_run = app.load_snapshot()
+    assert saved_next_run == next_run
+    assert saved.version == app.snapshot.version
+    assert saved.contests == app.snapshot.contests
+    assert saved.deadlines == app.snapshot.deadlines
+    assert saved.graphics == app.snapshot.graphics
+    assert saved.meta == app.snapshot.meta
+
+
+def test_snapshot_is_loaded_without_the_app(app, snapshot_file, tmp_path):
+    """The server may run as __main__ or as app, so the file must not name either module."""
+    app.save_snapshot(app.snapshot, datetime.now())
+    subprocess.run([sys.executable, '-c', 'import pickle, sys; pickle.load(open(sys.argv[1], "rb"))', snapshot_file],
+                   cwd=tmp_path, check=True)
+
+
+def test_unscraped_snapshot_is_not_loaded(app, snapshot_file):
+    app.save_snapshot(app.make_snapshot(0, []), datetime.now())
+    assert app.load_snapshot() is None
+
+
+def test_missing_snapshot_is_not_loaded(app, snapshot_file):
+    assert app.load_snapshot() is None
+
+
+def test_leader_is_taken_over(app, monkeypatch, tmp_path):
+    pytest.importorskip('fcntl')
+    assert app.leader_lock  # Importing app made this process the leader
+    monkeypatch.setattr(app, 'LEADER_LOCK_FILE', str(tmp_path / 'scraper.lock'))
+    monkeypatch.setattr(app, 'leader_lock', None)
+    leader = subprocess.Popen([sys.executable, '-c',
+                               'import fcntl, sys\n'
+                               'lock_file = open(sys.argv[1], "a")\n'
+                               'fcntl.flock(lock_file, fcntl.LOCK_EX)\n'
+                               'print("leading", flush=True)\n'
+                               'sys.stdin.read()\n',
+                               app.LEADER_LOCK_FILE], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        assert leader.stdout.readline() == b'leading\n'
+        assert not app.acquire_leader_lock()
+        assert app.leader_lock is None
+    finally:
+        leader.stdin.close()
+        leader.wait()
+    assert app.acquire_leader_lock()
+    app.leader_lock.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_worker_follows_with_its_own_locks(app):
+    """As with gunicorn --preload, while a scrape in the parent holds its locks."""
+    with app.update_condition, app.cache_total.lock, app.scrape_seconds.lock, app.sessions_lock, \
+            app.image_lru.lock:
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(5)  # A lock left held would hang the worker
+            try:
+                app.cache_total.inc('test', 'fork')
+                with app.scrape_seconds.time('test'):
+                    app.get_session('http://127.0.0.1/')
+                app.image_lru.get(('test',))
+                with app.update_condition:
+                    pass
+                os._exit(0 if app.leader_lock is None else 2)
+            finally:
+                os._exit(1)
+    pid, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0